@@ -0,0 +1,136 @@
+# audio_cache.py
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+from audio_encoding import ENCODINGS
+
+class AudioCache:
+    """Content-addressed store of synthesized audio in the output directory.
+
+    Files are named tts_<sha256>.wav after the synthesis parameters, so a
+    repeated line maps straight to the file rendered the first time. The
+    index keeps sizes in least recently used order and deletes the oldest
+    files once max_bytes is exceeded.
+    """
+
+    def __init__(self, directory="/root/output/", max_bytes=1024 * 1024 * 1024, prefix="tts_", extension=".wav"):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._prefix = prefix
+        self._extension = extension
+        self._index = OrderedDict()  # digest -> size, least recently used first
+        self._total_bytes = 0
+        self._lock = Lock()
+        self._loaded = False
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self.on_remove = None  # Called with each filename the cache deletes
+        self.is_pinned = None  # Called with a filename; pinned files are never evicted
+
+    @staticmethod
+    def key(text, edge_voice=None, rvc_model=None, rvc_pitch=0, tts_rate=0, model_version=None):
+        """Digest identifying one rendering of text.
+
+        model_version should change whenever the voice model's files do, so
+        a re-uploaded model doesn't keep serving audio from the old one.
+        """
+        params = [text, edge_voice, rvc_model, float(rvc_pitch or 0), float(tts_rate or 0), model_version]
+        return hashlib.sha256(json.dumps(params).encode('utf-8')).hexdigest()
+
+    def filename(self, digest):
+        return f"{self._prefix}{digest}{self._extension}"
+
+    def lookup(self, digest):
+        """Filename of a cached rendering, or None"""
+        with self._lock:
+            self._ensure_loaded()
+            if digest in self._index:
+                if os.path.exists(os.path.join(self._directory, self.filename(digest))):
+                    self._index.move_to_end(digest)
+                    self._hits += 1
+                    return self.filename(digest)
+                # Removed behind our back
+                self._total_bytes -= self._index.pop(digest)
+            self._misses += 1
+            return None
+
+    def store(self, digest, source_path):
+        """Move a freshly rendered file into the cache and return its filename"""
+        filename = self.filename(digest)
+        os.replace(source_path, os.path.join(self._directory, filename))
+        size = os.path.getsize(os.path.join(self._directory, filename))
+        with self._lock:
+            self._ensure_loaded()
+            self._total_bytes += size - self._index.pop(digest, 0)
+            self._index[digest] = size
+            self._evict_over_capacity(keep=digest)
+        return filename
+
+    def forget(self, filename):
+        """Drop the index entry for a file deleted outside the cache"""
+        if not (filename.startswith(self._prefix) and filename.endswith(self._extension)):
+            return
+        digest = filename[len(self._prefix):-len(self._extension)]
+        with self._lock:
+            if digest in self._index:
+                self._total_bytes -= self._index.pop(digest)
+
+    def _ensure_loaded(self):
+        """Rebuild the index from files left by a previous run. Caller holds _lock."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isdir(self._directory):
+            return
+        entries = []
+        with os.scandir(self._directory) as it:
+            for entry in it:
+                if entry.name.startswith(self._prefix) and entry.name.endswith(self._extension):
+                    stat = entry.stat()
+                    digest = entry.name[len(self._prefix):-len(self._extension)]
+                    entries.append((stat.st_atime, digest, stat.st_size))
+        for _, digest, size in sorted(entries):
+            self._index[digest] = size
+            self._total_bytes += size
+        self._evict_over_capacity()
+        print(f"Audio cache loaded {len(self._index)} files ({self._total_bytes} bytes)")
+
+    def _evict_over_capacity(self, keep=None):
+        """Delete least recently used files until within max_bytes. Caller holds _lock."""
+        for digest in list(self._index.keys()):
+            if self._max_bytes is None or self._total_bytes <= self._max_bytes:
+                break
+            if digest == keep or (self.is_pinned and self.is_pinned(self.filename(digest))):
+                continue
+            self._total_bytes -= self._index.pop(digest)
+            self._evictions += 1
+            self._remove_files(digest)
+
+    def _remove_files(self, digest):
+        """Delete a cached rendering along with any transcoded copies"""
+        for _, extension, _ in ENCODINGS.values():
+            path = os.path.join(self._directory, f"{self._prefix}{digest}{extension}")
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+                    if self.on_remove:
+                        self.on_remove(os.path.basename(path))
+            except OSError as e:
+                print(f"Error removing cached audio {path}: {e}")
+
+    def get_stats(self):
+        """Get current cache statistics"""
+        with self._lock:
+            return {
+                'files': len(self._index),
+                'total_bytes': self._total_bytes,
+                'max_bytes': self._max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions
+            }
+
+audio_cache = AudioCache()
@@ -0,0 +1,93 @@
+# audio_encoding.py
+import os
+import shutil
+import subprocess
+import threading
+
+# name -> (mimetype, extension, ffmpeg output arguments); TTS output is always
+# written as WAV and other encodings are transcoded from it on first request
+ENCODINGS = {
+    'opus': ('audio/ogg', '.opus', ['-c:a', 'libopus', '-b:a', '32k', '-f', 'ogg']),
+    # No ID3 tag or Xing frame, so MP3 files can be concatenated into one stream
+    'mp3': ('audio/mpeg', '.mp3', ['-c:a', 'libmp3lame', '-b:a', '64k', '-id3v2_version', '0', '-write_xing', '0', '-f', 'mp3']),
+    'wav': ('audio/wav', '.wav', None),
+}
+MIMETYPE_ENCODINGS = {
+    'audio/ogg': 'opus',
+    'audio/opus': 'opus',
+    'audio/webm': 'opus',
+    'audio/mpeg': 'mp3',
+    'audio/mp3': 'mp3',
+    'audio/wav': 'wav',
+    'audio/x-wav': 'wav',
+    'audio/wave': 'wav',
+}
+TRANSCODE_TIMEOUT = 60
+
+_transcode_locks = {}
+_transcode_locks_guard = threading.Lock()
+
+def transcoder_available():
+    return shutil.which('ffmpeg') is not None
+
+def encoding_for_extension(extension):
+    for name, (_, ext, _) in ENCODINGS.items():
+        if ext == extension:
+            return name
+    return None
+
+def negotiate(accept_header, requested=None, default='wav'):
+    """Pick an encoding from an explicit ?format=, then the Accept header, then the default"""
+    if requested in ENCODINGS:
+        return requested
+
+    best, best_q = None, 0.0
+    for part in (accept_header or '').split(','):
+        fields = [field.strip() for field in part.split(';')]
+        encoding = MIMETYPE_ENCODINGS.get(fields[0].lower())
+        if not encoding:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        # Ties go to the smaller encoding
+        if q > best_q or (q == best_q and best and list(ENCODINGS).index(encoding) < list(ENCODINGS).index(best)):
+            best, best_q = encoding, q
+    return best or default
+
+def encoded_path(wav_path, encoding):
+    """Path of wav_path in the given encoding, transcoding it with ffmpeg if needed"""
+    _, extension, ffmpeg_args = ENCODINGS[encoding]
+    target_path = os.path.splitext(wav_path)[0] + extension
+    if os.path.exists(target_path):
+        return target_path
+    if ffmpeg_args is None or not os.path.exists(wav_path):
+        return None
+
+    with _transcode_locks_guard:
+        lock = _transcode_locks.setdefault(target_path, threading.Lock())
+    try:
+        with lock:
+            # Another request may have finished the same file while we waited
+            if os.path.exists(target_path):
+                return target_path
+            temp_path = f"{target_path}.part"
+            try:
+                subprocess.run(
+                    ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', wav_path] + ffmpeg_args + [temp_path],
+                    check=True,
+                    timeout=TRANSCODE_TIMEOUT
+                )
+                os.replace(temp_path, target_path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            return target_path
+    finally:
+        with _transcode_locks_guard:
+            _transcode_locks.pop(target_path, None)
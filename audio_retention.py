@@ -0,0 +1,157 @@
+# audio_retention.py
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class AudioRetention:
+    """Bounds the generated-audio directory by age and total size.
+
+    Sizes and last-served times live in an in-memory index, least recently
+    served first, so a sweep only walks the index. The directory is listed
+    again every rescan_interval seconds to pick up files written elsewhere;
+    only names the index doesn't know are stat'ed. Files is_pinned(filename)
+    holds on to are never removed. Sweeping begins with start(), so callers
+    can finish wiring is_pinned first.
+    """
+
+    def __init__(self, directory, max_age=7 * 24 * 3600, max_bytes=2 * 1024 * 1024 * 1024,
+                 interval=300, rescan_interval=3600, on_remove=None, is_pinned=None):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.rescan_interval = rescan_interval
+        self.on_remove = on_remove  # Called with each deleted filename
+        self.is_pinned = is_pinned
+        self._index = OrderedDict()  # filename -> [size, last_access]
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._last_rescan = 0
+        self._removed = 0
+        self._removed_bytes = 0
+        self._thread = None
+
+    def start(self):
+        """Sweep every interval seconds in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sweep_loop, name="audio-retention", daemon=True)
+            self._thread.start()
+
+    def touch(self, filename):
+        """Record that a file was written or served"""
+        with self._lock:
+            entry = self._index.get(filename)
+            if entry is not None:
+                entry[1] = time.time()
+                self._index.move_to_end(filename)
+                return
+        try:
+            size = os.path.getsize(os.path.join(self.directory, filename))
+        except OSError:
+            return
+        with self._lock:
+            if filename not in self._index:
+                self._add(filename, size, time.time())
+
+    def forget(self, filename):
+        """Drop a file deleted by someone else from the index"""
+        with self._lock:
+            self._forget(filename)
+
+    def sweep(self):
+        """Delete files past max_age, then least recently served ones over max_bytes"""
+        if time.time() - self._last_rescan >= self.rescan_interval:
+            self._rescan()
+
+        expired = []
+        with self._lock:
+            cutoff = time.time() - self.max_age
+            for filename, (size, last_access) in list(self._index.items()):
+                over_age = last_access < cutoff
+                over_bytes = self.max_bytes is not None and self._total_bytes > self.max_bytes
+                if not (over_age or over_bytes):
+                    break
+                if self.is_pinned and self.is_pinned(filename):
+                    continue
+                del self._index[filename]
+                self._total_bytes -= size
+                expired.append((filename, size))
+
+        for filename, size in expired:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error removing audio file {filename}: {e}")
+                continue
+            self._removed += 1
+            self._removed_bytes += size
+            if self.on_remove:
+                self.on_remove(filename)
+        if expired:
+            print(f"Audio retention removed {len(expired)} files")
+
+    def _rescan(self):
+        """Reconcile the index with the directory listing"""
+        self._last_rescan = time.time()
+        if not os.path.isdir(self.directory):
+            return
+        with self._lock:
+            known = set(self._index)
+        found = []
+        present = set()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                # .part files are transcodes still being written
+                if not entry.is_file() or entry.name.endswith('.part'):
+                    continue
+                present.add(entry.name)
+                if entry.name not in known:
+                    stat = entry.stat()
+                    found.append((max(stat.st_atime, stat.st_mtime), entry.name, stat.st_size))
+
+        with self._lock:
+            for filename in known - present:
+                self._forget(filename)
+            # Oldest first so untracked files slot in by their own age
+            for last_access, filename, size in sorted(found):
+                if filename not in self._index:
+                    self._add(filename, size, last_access)
+            self._index = OrderedDict(sorted(self._index.items(), key=lambda item: item[1][1]))
+
+    def _forget(self, filename):
+        """Caller holds _lock"""
+        entry = self._index.pop(filename, None)
+        if entry:
+            self._total_bytes -= entry[0]
+
+    def _add(self, filename, size, last_access):
+        """Caller holds _lock"""
+        self._index[filename] = [size, last_access]
+        self._total_bytes += size
+
+    def get_stats(self):
+        """Get current retention statistics"""
+        with self._lock:
+            oldest = next(iter(self._index.values()), None)
+            return {
+                'directory': self.directory,
+                'files': len(self._index),
+                'total_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'max_age_seconds': self.max_age,
+                'oldest_access': time.ctime(oldest[1]) if oldest else None,
+                'removed_files': self._removed,
+                'removed_bytes': self._removed_bytes,
+                'last_rescan': time.ctime(self._last_rescan) if self._last_rescan else None
+            }
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error in audio retention sweep: {e}")
+            time.sleep(self.interval)
@@ -0,0 +1,33 @@
+# bench_queue.py
+# Measures RequestQueue enqueue and status-lookup latency as the backlog grows.
+# Run with: python bench_queue.py
+import time
+from queue_system import RequestQueue
+
+SIZES = [10, 100, 1000, 10000, 100000]
+USERS = 50  # Position lookups scale with active users, not queue length
+LOOKUPS = 10000
+
+def bench(size):
+    # No workers, so the backlog stays queued while we measure it
+    queue = RequestQueue(max_concurrent=0)
+
+    start = time.perf_counter()
+    ids = [queue.add_request(f"user-{i % USERS}", 'chat', {}) for i in range(size)]
+    enqueue_us = (time.perf_counter() - start) / size * 1e6
+
+    # Look up the tail of the queue, the worst case for a linear scan
+    last_id = ids[-1]
+    start = time.perf_counter()
+    for _ in range(LOOKUPS):
+        status = queue.get_status(last_id)
+    status_us = (time.perf_counter() - start) / LOOKUPS * 1e6
+
+    assert status['position'] == size
+    return enqueue_us, status_us
+
+if __name__ == '__main__':
+    print(f"{'queued':>8} {'enqueue us':>12} {'get_status us':>14}")
+    for size in SIZES:
+        enqueue_us, status_us = bench(size)
+        print(f"{size:>8} {enqueue_us:>12.2f} {status_us:>14.2f}")
@@ -0,0 +1,461 @@
+# character_catalog.py
+import base64
+import bisect
+import heapq
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+# Fields a character grid card needs; fields=card projects listings down to these
+CARD_FIELDS = ('id', 'name', 'description', 'avatar', 'background', 'category', 'tags',
+               'creator', 'dateAdded', 'isPrivate', 'isApproved', 'approvalStatus')
+
+# How much a term counts towards search relevance depending on the field it's in
+SEARCH_FIELD_WEIGHTS = (('name', 5.0), ('tags', 3.0), ('category', 2.0), ('description', 2.0), ('systemPrompt', 1.0))
+SEARCH_TOKEN = re.compile(r"[^\W_]+")
+
+class CharacterCatalog:
+    """Process-wide, in-memory copy of every character.
+
+    Characters are loaded once from source and kept in secondary indexes
+    by creator, approval status and privacy, plus an inverted index of the
+    words in their searchable fields. Writers call put() or remove() after
+    storing a character so listings and search never touch the database.
+    A polling watcher picks up writes made by other worker processes,
+    re-reading only characters whose version changed.
+
+    source provides load() and read(ids), both returning
+    {id: (version, data)}, versions() returning {id: version}, and
+    fingerprint(), a cheap value that changes whenever any character does.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._characters = {}  # id -> character data
+        self._by_creator = defaultdict(set)
+        self._by_status = defaultdict(set)  # 'approved' when isApproved, else approvalStatus
+        self._by_privacy = defaultdict(set)  # isPrivate -> ids
+        self._by_date = []  # Sorted (dateAdded, id) pairs
+        self._postings = defaultdict(dict)  # term -> {id: field-weighted frequency}
+        self._vocabulary = []  # Sorted terms, for prefix matching
+        self._doc_terms = {}  # id -> terms indexed for it
+        self._greeting_files = Counter()  # Pre-rendered greeting audio filename -> characters using it
+        self._versions = {}  # id -> version last loaded or written
+        self._fingerprint = None
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._watcher = None
+        self._reloads = 0
+        # Popularity rankings, newest last: version -> sorted (-popularity, id)
+        # pairs. Pages walk a snapshot so cursors don't drift as counts change
+        self.popularity_interval = 300  # Seconds before a ranking is rebuilt
+        self._rankings = OrderedDict()
+        self._ranking_in_progress = False
+
+    def get(self, character_id):
+        """Copy of one character's data, or None"""
+        with self._lock:
+            self._ensure_loaded()
+            char_data = self._characters.get(character_id)
+            return dict(char_data) if char_data is not None else None
+
+    def put(self, character_id, char_data, version=None):
+        """Insert or replace a character after it has been stored"""
+        with self._lock:
+            self._ensure_loaded()
+            self._unindex(character_id)
+            self._index(character_id, dict(char_data))
+            # Our own write shouldn't look like an outside change to the watcher
+            self._versions[character_id] = version
+
+    def remove(self, character_id):
+        with self._lock:
+            self._ensure_loaded()
+            self._unindex(character_id)
+            self._versions.pop(character_id, None)
+
+    def refresh(self):
+        """Re-read characters changed in the source since they were last seen; returns the number reloaded"""
+        with self._lock:
+            self._ensure_loaded()
+        fingerprint = self.source.fingerprint()
+        if fingerprint == self._fingerprint:
+            return 0
+        with self._lock:
+            known = dict(self._versions)
+
+        versions = self.source.versions()
+        changed = [character_id for character_id, version in versions.items() if known.get(character_id) != version]
+        rows = self.source.read(changed) if changed else {}
+
+        reloaded = 0
+        with self._lock:
+            for character_id, (version, char_data) in rows.items():
+                # Skip if a local write landed while we were reading
+                if self._versions.get(character_id) != known.get(character_id):
+                    continue
+                self._unindex(character_id)
+                self._index(character_id, char_data)
+                self._versions[character_id] = version
+                reloaded += 1
+            for character_id in set(known) - set(versions):
+                if self._versions.get(character_id) == known[character_id]:
+                    self._unindex(character_id)
+                    self._versions.pop(character_id, None)
+                    reloaded += 1
+            self._reloads += reloaded
+        self._fingerprint = fingerprint
+        return reloaded
+
+    def start_watching(self, interval=2):
+        """Poll the source every interval seconds in a daemon thread"""
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch_loop, args=(interval,), name="character-catalog-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                reloaded = self.refresh()
+                if reloaded:
+                    print(f"Character catalog reloaded {reloaded} changed characters")
+            except Exception as e:
+                print(f"Error refreshing character catalog: {e}")
+
+    def uses_audio(self, filename):
+        """Whether a character's pre-rendered greetings point at this audio file"""
+        with self._lock:
+            self._ensure_loaded()
+            return filename in self._greeting_files
+
+    def public(self):
+        """Approved characters that aren't private"""
+        return self._select(self._public_ids)
+
+    def library(self, creator_id):
+        """A user's own characters plus every public one"""
+        return self._select(lambda: self._by_creator[str(creator_id)] | self._public_ids())
+
+    def pending(self):
+        """Public characters awaiting review"""
+        return self._select(lambda: self._by_privacy[False] & self._by_status['pending'])
+
+    def private(self, creator_id):
+        """A user's private characters"""
+        return self._select(lambda: self._by_creator[str(creator_id)] & self._by_privacy[True])
+
+    def by_creator(self, creator_id):
+        return self._select(lambda: self._by_creator[str(creator_id)])
+
+    def public_page(self, limit, **options):
+        """A page of public() for infinite scroll; options as for _page"""
+        return self._page(self._public_ids, limit, **options)
+
+    def library_page(self, creator_id, limit, section=None, **options):
+        """A page of library(), optionally limited to its 'private', 'public' or 'pending' section"""
+        def select_ids():
+            own = self._by_creator[str(creator_id)] if creator_id is not None else set()
+            private = own & self._by_privacy[True]
+            pending = own & self._by_privacy[False] & self._by_status['pending']
+            if section == 'private':
+                return private
+            if section == 'pending':
+                return pending
+            ids = own | self._public_ids()
+            return ids - private - pending if section == 'public' else ids
+        return self._page(select_ids, limit, **options)
+
+    def _page(self, select_ids, limit, cursor=None, sort='dateAdded', category=None, tags=(), popularity=None):
+        """One page of characters, newest or most popular first.
+
+        select_ids picks the candidate ids from the indexes, as in _select.
+        Returns (characters, next_cursor); next_cursor is None on the last
+        page. Raises ValueError for a cursor from a different sort.
+        """
+        after = decode_cursor(cursor, sort) if cursor else None
+        if sort == 'popularity':
+            if after and not (isinstance(after[0], list) and len(after[0]) == 2):
+                raise ValueError("Invalid cursor")
+            # Built outside _lock, since popularity takes the model cache's lock
+            version, ranking = self._popularity_ranking(popularity, after[0][0] if after else None)
+        category = category.lower() if category else None
+        tags = {tag.lower() for tag in tags}
+
+        def matches(char_data):
+            if category and (char_data.get('category') or '').lower() != category:
+                return False
+            if tags and not tags <= {str(tag).lower() for tag in char_data.get('tags') or []}:
+                return False
+            return True
+
+        with self._lock:
+            self._ensure_loaded()
+            ids = select_ids()
+            if sort == 'dateAdded':
+                # Walk the date index backwards from the cursor; stops after limit + 1 matches
+                start = bisect.bisect_left(self._by_date, tuple(after)) if after else len(self._by_date)
+                ordered = []
+                for position in range(start - 1, -1, -1):
+                    key, character_id = self._by_date[position]
+                    if character_id in ids and matches(self._characters[character_id]):
+                        ordered.append((key, character_id))
+                        if len(ordered) > limit:
+                            break
+            elif sort == 'popularity':
+                # Walk the snapshot forwards from the cursor; characters created
+                # since it was taken show up once it is rebuilt
+                (_, score), after_id = after if after else ((None, None), None)
+                start = bisect.bisect_right(ranking, (-score, after_id)) if after else 0
+                ordered = []
+                for position in range(start, len(ranking)):
+                    negated_score, character_id = ranking[position]
+                    if character_id in ids and matches(self._characters[character_id]):
+                        ordered.append(([version, -negated_score], character_id))
+                        if len(ordered) > limit:
+                            break
+            else:
+                raise ValueError(f"Unknown sort: {sort}")
+
+            characters = [self._characters[character_id] for _, character_id in ordered[:limit]]
+        next_cursor = encode_cursor(sort, ordered[limit - 1]) if len(ordered) > limit else None
+        return characters, next_cursor
+
+    def _popularity_ranking(self, popularity, version=None):
+        """(version, ranking) for the snapshot a cursor was issued against, or
+        else the newest one, rebuilt once it is popularity_interval old"""
+        with self._lock:
+            self._ensure_loaded()
+            if version in self._rankings:
+                return version, self._rankings[version]
+            newest = next(reversed(self._rankings), None)
+            stale = newest is None or time.time() * 1000 - newest >= self.popularity_interval * 1000
+            if newest is not None and (not stale or self._ranking_in_progress):
+                return newest, self._rankings[newest]
+            self._ranking_in_progress = True
+            characters = list(self._characters.items())
+        try:
+            ranking = sorted((-popularity(char_data), character_id) for character_id, char_data in characters)
+        finally:
+            with self._lock:
+                self._ranking_in_progress = False
+        with self._lock:
+            # Millisecond timestamps, so cursors from another worker rarely collide
+            version = max(int(time.time() * 1000), (newest or 0) + 1)
+            self._rankings[version] = ranking
+            while len(self._rankings) > 2:
+                self._rankings.popitem(last=False)
+        return version, ranking
+
+    def search(self, query, creator_id=None, limit=20):
+        """Characters matching every word of query, best match first.
+
+        The last word also matches as a prefix, so results follow the user
+        while they type. Only characters library(creator_id) would list are
+        returned. Returns (characters, total matches).
+        """
+        terms = tokenize(query)
+        if not terms:
+            return [], 0
+        with self._lock:
+            self._ensure_loaded()
+            total_docs = max(1, len(self._doc_terms))
+            scores = None
+            for position, term in enumerate(terms):
+                if position == len(terms) - 1:
+                    matched = self._prefix_terms(term)
+                else:
+                    matched = [term] if term in self._postings else []
+                term_scores = {}
+                for matched_term in matched:
+                    postings = self._postings[matched_term]
+                    idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    # Exact words beat prefix completions
+                    if matched_term != term:
+                        idf *= 0.5
+                    for character_id, frequency in postings.items():
+                        score = idf * frequency / (frequency + 1.2)
+                        term_scores[character_id] = max(term_scores.get(character_id, 0), score)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        character_id: score + term_scores[character_id]
+                        for character_id, score in scores.items()
+                        if character_id in term_scores
+                    }
+                if not scores:
+                    return [], 0
+
+            visible = self._public_ids()
+            if creator_id is not None:
+                visible = visible | self._by_creator[str(creator_id)]
+            ranked = [(score, character_id) for character_id, score in scores.items() if character_id in visible]
+            best = heapq.nlargest(limit, ranked)
+            return [self._characters[character_id] for _, character_id in best], len(ranked)
+
+    def counts(self):
+        """Character totals in the admin dashboard's categories"""
+        with self._lock:
+            self._ensure_loaded()
+            listed = self._by_privacy[False]
+            return {
+                'total_characters': len(self._characters),
+                'private_characters': len(self._by_privacy[True]),
+                'approved_characters': len(listed & self._by_status['approved']),
+                'public_characters': len(listed & self._by_status['approved']),
+                'pending_characters': len(listed & self._by_status['pending']),
+                'rejected_characters': len(listed & self._by_status['rejected'])
+            }
+
+    def reload(self):
+        """Drop everything and load from the source again"""
+        with self._lock:
+            self._loaded = False
+            self._characters.clear()
+            self._by_creator.clear()
+            self._by_status.clear()
+            self._by_privacy.clear()
+            self._by_date.clear()
+            self._postings.clear()
+            self._vocabulary.clear()
+            self._doc_terms.clear()
+            self._greeting_files.clear()
+            self._versions.clear()
+            self._fingerprint = None
+            self._ensure_loaded()
+
+    def _public_ids(self):
+        return self._by_privacy[False] & self._by_status['approved']
+
+    def _select(self, select_ids):
+        """Character dicts for the ids select_ids() picks from the indexes, ordered
+        by id. Callers must not modify them."""
+        with self._lock:
+            self._ensure_loaded()
+            return [self._characters[character_id] for character_id in sorted(select_ids())]
+
+    def _ensure_loaded(self):
+        """Caller holds _lock"""
+        if self._loaded:
+            return
+        self._fingerprint = self.source.fingerprint()
+        for character_id, (version, char_data) in self.source.load().items():
+            self._index(character_id, char_data, bulk=True)
+            self._versions[character_id] = version
+        # Sorted once here rather than insorted per character, which is quadratic
+        self._by_date.sort()
+        self._vocabulary.sort()
+        self._loaded = True
+        print(f"Character catalog loaded {len(self._characters)} characters")
+
+    def _index(self, character_id, char_data, bulk=False):
+        """Caller holds _lock. With bulk, the sorted lists are appended to and
+        the caller sorts them afterwards."""
+        char_data.setdefault('id', character_id)
+        self._characters[character_id] = char_data
+        self._by_creator[str(char_data.get('creator'))].add(character_id)
+        self._by_status[self._status_of(char_data)].add(character_id)
+        self._by_privacy[bool(char_data.get('isPrivate', False))].add(character_id)
+        if bulk:
+            self._by_date.append(self._date_key(character_id, char_data))
+        else:
+            bisect.insort(self._by_date, self._date_key(character_id, char_data))
+        self._greeting_files.update(self._audio_files_of(char_data))
+        self._index_terms(character_id, char_data, bulk)
+
+    def _unindex(self, character_id):
+        """Caller holds _lock"""
+        char_data = self._characters.pop(character_id, None)
+        if char_data is None:
+            return
+        self._by_creator[str(char_data.get('creator'))].discard(character_id)
+        self._by_status[self._status_of(char_data)].discard(character_id)
+        self._by_privacy[bool(char_data.get('isPrivate', False))].discard(character_id)
+        date_key = self._date_key(character_id, char_data)
+        position = bisect.bisect_left(self._by_date, date_key)
+        if position < len(self._by_date) and self._by_date[position] == date_key:
+            del self._by_date[position]
+        for filename in self._audio_files_of(char_data):
+            self._greeting_files[filename] -= 1
+            if self._greeting_files[filename] <= 0:
+                del self._greeting_files[filename]
+        self._unindex_terms(character_id)
+
+    def _index_terms(self, character_id, char_data, bulk=False):
+        """Caller holds _lock"""
+        frequencies = defaultdict(float)
+        for field, weight in SEARCH_FIELD_WEIGHTS:
+            value = char_data.get(field)
+            if isinstance(value, list):
+                value = ' '.join(str(item) for item in value)
+            for term in tokenize(value):
+                frequencies[term] += weight
+        for term, frequency in frequencies.items():
+            if term not in self._postings:
+                if bulk:
+                    self._vocabulary.append(term)
+                else:
+                    bisect.insort(self._vocabulary, term)
+            self._postings[term][character_id] = frequency
+        self._doc_terms[character_id] = list(frequencies)
+
+    def _unindex_terms(self, character_id):
+        """Caller holds _lock"""
+        for term in self._doc_terms.pop(character_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(character_id, None)
+            if not postings:
+                del self._postings[term]
+                position = bisect.bisect_left(self._vocabulary, term)
+                if position < len(self._vocabulary) and self._vocabulary[position] == term:
+                    del self._vocabulary[position]
+
+    def _prefix_terms(self, prefix):
+        """Caller holds _lock"""
+        position = bisect.bisect_left(self._vocabulary, prefix)
+        terms = []
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(prefix):
+            terms.append(self._vocabulary[position])
+            position += 1
+        return terms
+
+    @staticmethod
+    def _date_key(character_id, char_data):
+        return (str(char_data.get('dateAdded') or ''), character_id)
+
+    @staticmethod
+    def _audio_files_of(char_data):
+        greeting_audio = char_data.get('greetingAudio')
+        if not isinstance(greeting_audio, dict):
+            return []
+        return [str(url).rsplit('/', 1)[-1] for url in greeting_audio.values() if url]
+
+    @staticmethod
+    def _status_of(char_data):
+        return 'approved' if char_data.get('isApproved', False) else char_data.get('approvalStatus')
+
+def tokenize(text):
+    return SEARCH_TOKEN.findall(str(text).lower()) if text else []
+
+def project(char_data, fields):
+    """Subset of a character's fields, for lightweight listings"""
+    return {field: char_data[field] for field in fields if field in char_data}
+
+def encode_cursor(sort, position):
+    """Opaque cursor pointing just past position, a (sort key, id) pair"""
+    return base64.urlsafe_b64encode(json.dumps([sort, *position]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort):
+    try:
+        cursor_sort, key, character_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor belongs to a different sort")
+    return key, character_id
@@ -0,0 +1,153 @@
+# character_store.py
+import json
+import os
+from sqlalchemy import func, inspect, select, text
+from character_catalog import CharacterCatalog
+
+class CharacterStore:
+    """The character table is the single place characters are stored.
+
+    Each row holds the full character document in its data column, with
+    the fields queries filter on (creator, privacy, approval) copied into
+    indexed columns by model.apply(). Writes go to the row and then
+    through to the in-memory catalog, which serves every read; the catalog
+    polls the table to pick up writes from other worker processes.
+
+    Every write stamps the row with the next value of a table-wide version
+    counter, so (row count, highest version) changes on any insert, update
+    or delete and a row's version tells the catalog whether it changed.
+    """
+
+    def __init__(self, db, model):
+        self._db = db
+        self._model = model
+        self._table = model.__table__
+        self._engine = None
+        self.catalog = CharacterCatalog(self)
+
+    def ensure_schema(self):
+        """Add the data and version columns and indexes to a character table created
+        before them. Call inside an app context after db.create_all()."""
+        self._engine = self._db.engine
+        columns = {column['name'] for column in inspect(self._engine).get_columns(self._table.name)}
+        with self._engine.begin() as conn:
+            if 'data' not in columns:
+                conn.execute(text(f"ALTER TABLE {self._table.name} ADD COLUMN data JSON"))
+                print("Added data column to the character table")
+            if 'version' not in columns:
+                conn.execute(text(f"ALTER TABLE {self._table.name} ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+                print("Added version column to the character table")
+            for index in self._table.indexes:
+                index.create(conn, checkfirst=True)
+
+    def get(self, character_id):
+        """Copy of a character's document, or None"""
+        return self.catalog.get(character_id)
+
+    def save(self, character_id, char_data, commit=True):
+        """Write a character's row and update the catalog once it's committed.
+
+        With commit=False the caller commits and then calls cache() with
+        the returned row, so the row can share a transaction with other
+        changes.
+        """
+        row = self._db.session.get(self._model, character_id)
+        if row is None:
+            row = self._model(id=character_id)
+            self._db.session.add(row)
+        row.apply(dict(char_data, id=character_id))
+        # Autoflush makes rows written earlier in this transaction count
+        row.version = (self._db.session.execute(select(func.max(self._table.c.version))).scalar() or 0) + 1
+        if commit:
+            self._db.session.commit()
+            self.cache(row)
+        return row
+
+    def cache(self, row):
+        self.catalog.put(row.id, self._model.document_of(row), version=row.version)
+
+    def delete(self, character_id, commit=True):
+        """Delete a character's row and drop it from the catalog once that's committed.
+
+        With commit=False the caller commits and then calls uncache(), so a
+        rolled-back delete doesn't hide a character that still exists.
+        """
+        row = self._db.session.get(self._model, character_id)
+        if row is not None:
+            self._db.session.delete(row)
+        if commit:
+            self._db.session.commit()
+            self.uncache(character_id)
+        return row
+
+    def uncache(self, character_id):
+        self.catalog.remove(character_id)
+
+    def import_if_empty(self, directory, default_creator=None):
+        """First-run import of the character files while the table has no rows.
+        Returns import_files()' result, or None if nothing was imported."""
+        with self._engine.connect() as conn:
+            if conn.execute(select(func.count()).select_from(self._table)).scalar():
+                return None
+        if not os.path.isdir(directory):
+            return None
+        return self.import_files(directory, default_creator=default_creator)
+
+    def import_files(self, directory, default_creator=None, skip_files=('index.json',)):
+        """One-shot migration of <id>.json character files into the table.
+
+        A file's own id wins over its filename. Rows that already exist are
+        overwritten from the file, since the files were what the site served.
+        Returns (imported ids, {filename: error}).
+        """
+        imported, failed = [], {}
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.json') or filename in skip_files:
+                continue
+            try:
+                with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                    char_data = json.load(f)
+                character_id = str(char_data.get('id') or filename[:-len('.json')])
+                if character_id in imported:
+                    raise ValueError(f"Duplicate character id {character_id}")
+                if not char_data.get('creator') and default_creator:
+                    char_data['creator'] = default_creator
+                # A savepoint per file, so one bad file doesn't undo the others
+                with self._db.session.begin_nested():
+                    self.save(character_id, char_data, commit=False)
+                imported.append(character_id)
+            except Exception as e:
+                failed[filename] = str(e)
+        self._db.session.commit()
+        self.catalog.reload()
+        return imported, failed
+
+    # Catalog source
+
+    def load(self):
+        return self._rows(select(self._table))
+
+    def read(self, character_ids):
+        rows = {}
+        character_ids = list(character_ids)
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(character_ids), 500):
+            batch = character_ids[start:start + 500]
+            rows.update(self._rows(select(self._table).where(self._table.c.id.in_(batch))))
+        return rows
+
+    def versions(self):
+        with self._engine.connect() as conn:
+            return dict(conn.execute(select(self._table.c.id, self._table.c.version)).all())
+
+    def fingerprint(self):
+        """Row count and highest version; changes on any insert, update or delete"""
+        with self._engine.connect() as conn:
+            return tuple(conn.execute(select(func.count(), func.max(self._table.c.version)).select_from(self._table)).one())
+
+    def _rows(self, query):
+        with self._engine.connect() as conn:
+            return {
+                row.id: (row.version, self._model.document_of(row))
+                for row in conn.execute(query)
+            }
@@ -71,6 +71,13 @@ const imageFormats = ['webp', 'gif', 'jpg', 'png'];
 const allFormats = [...videoFormats, ...imageFormats];
 
 // Helper Functions
+// Ask for Opus where the browser plays it (a fraction of the WAV size), else MP3
+const AUDIO_FORMAT = new Audio().canPlayType('audio/ogg; codecs="opus"') ? 'opus' : 'mp3';
+
+function audioSource(audioUrl) {
+    return `${audioUrl}${audioUrl.includes('?') ? '&' : '?'}format=${AUDIO_FORMAT}`;
+}
+
 function filterTextForTTS(text) {
     return text.replace(/\*[^*]*\*/g, '').trim();
 }
@@ -178,7 +185,11 @@ function sendInitialGreeting() {
 
     if (audioEnabled) {
         const ttsText = filterTextForTTS(characterGreeting);
-        if (ttsText) {
+        const preRendered = character.greetingAudio?.[characterGreeting];
+        if (preRendered) {
+            // Rendered when the character was saved; plays without a TTS round trip
+            messageQueue = [{ audioUrl: preRendered, fallbackText: ttsText }];
+        } else if (ttsText) {
             console.log("Adding greeting to message queue:", ttsText);
             messageQueue = [ttsText];
             console.log("Current message queue:", messageQueue);
@@ -255,6 +266,68 @@ function addMessage(sender, text) {
             chatHistory = chatHistory.slice(-MAX_HISTORY_LENGTH * 2);
         }
     }
+
+    return textBubble;
+}
+
+// Queue audio segments for the reply as the server synthesizes them, sentence by sentence
+function subscribeToSpeech(pipelineId) {
+    const source = new EventSource(`/v1/tts/pipeline/${pipelineId}/events`);
+    source.onmessage = (event) => {
+        const segment = JSON.parse(event.data);
+        if (!audioEnabled) {
+            return;
+        }
+        if (segment.error) {
+            console.error("Speech segment error:", segment.error);
+            return;
+        }
+        messageQueue.push({ audioUrl: segment.audio_url });
+        if (!isAudioPlaying) {
+            processNextInQueue();
+        }
+    };
+    source.addEventListener('end', () => source.close());
+    source.onerror = () => source.close();
+}
+
+// Read an SSE chat completion stream, updating the bubble as tokens arrive
+async function readCompletionStream(response, textBubble) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let content = "";
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        for (const event of events) {
+            const dataLine = event.split("\n").find(line => line.startsWith("data:"));
+            if (!dataLine) continue;
+            const payload = dataLine.slice(5).trim();
+            if (event.startsWith("event: error")) {
+                throw new Error(JSON.parse(payload).error);
+            }
+            if (event.startsWith("event: speech")) {
+                subscribeToSpeech(JSON.parse(payload).pipeline_id);
+                continue;
+            }
+            if (payload === "[DONE]") {
+                return content;
+            }
+            const delta = JSON.parse(payload).choices?.[0]?.delta?.content;
+            if (delta) {
+                content += delta;
+                textBubble.innerHTML = content.replace(/\*(.*?)\*/g, '<em>$1</em>');
+                chatLog.scrollTop = chatLog.scrollHeight;
+            }
+        }
+    }
+    throw new Error("Stream ended before completion");
 }
 
 async function sendMessage(userMessage = null) {
@@ -314,7 +387,15 @@ async function sendMessage(userMessage = null) {
                 max_tokens: character.ai_parameters?.max_tokens || 150,
                 top_p: sessionParameters.ai.topP,
                 presence_penalty: sessionParameters.ai.presencePenalty,
-                frequency_penalty: sessionParameters.ai.frequencyPenalty
+                frequency_penalty: sessionParameters.ai.frequencyPenalty,
+                stream: true,
+                // Speak the reply sentence by sentence while it generates
+                tts: audioEnabled ? {
+                    edge_voice: character.ttsVoice,
+                    rvc_model: character.existingCharacterModel || character.rvc_model || character.id,
+                    tts_rate: sessionParameters.voice.ttsRate,
+                    rvc_pitch: sessionParameters.voice.rvcPitch
+                } : undefined
             })
         });
 
@@ -327,9 +408,8 @@ async function sendMessage(userMessage = null) {
             throw new Error(`API error: ${response.status}`);
         }
 
-        const responseData = await response.json();
-        const botMessage = responseData.choices[0].message.content.trim();
-        addMessage("bot", botMessage);
+        const textBubble = addMessage("bot", "");
+        await readCompletionStream(response, textBubble);
 
         // Update credits after successful message
         if (currentUser) {
@@ -338,16 +418,6 @@ async function sendMessage(userMessage = null) {
             console.log(`Credits used: ${creditCost}. Remaining credits: ${currentUser.credits}`);
         }
 
-        if (audioEnabled) {
-            const ttsText = filterTextForTTS(botMessage);
-            if (ttsText) {
-                messageQueue.push(ttsText);
-                if (!isAudioPlaying) {
-                    processNextInQueue();
-                }
-            }
-        }
-
     } catch (error) {
         console.error("Error details:", error);
         addMessage("bot", "I apologize, there was an error. Your credits have been refunded.");
@@ -378,6 +448,13 @@ async function processNextInQueue() {
 
     try {
         const text = messageQueue[0];
+
+        // Segments from a speech pipeline are already synthesized
+        if (text.audioUrl) {
+            await playAudio(text.audioUrl);
+            return;
+        }
+
         console.log("Processing TTS for text:", text);
         
         const voiceModel = character.existingCharacterModel || character.rvc_model || character.id;
@@ -392,23 +469,17 @@ async function processNextInQueue() {
 
         console.log("Sending TTS request:", requestBody);
 
-        const ttsResponse = await fetch('/v1/tts', {
+        // Streamed synthesis, paid for once here; playback starts with the first sentence
+        const response = await fetch('/v1/tts/stream', {
             method: "POST",
             headers: { "Content-Type": "application/json" },
             body: JSON.stringify(requestBody)
         });
-
-        if (!ttsResponse.ok) {
-            throw new Error(`TTS API error: ${ttsResponse.status}`);
-        }
-
-        const ttsData = await ttsResponse.json();
-        
-        if (!ttsData.audio_url) {
-            throw new Error("No audio URL received from TTS service");
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.error || `TTS request failed: ${response.status}`);
         }
-
-        await playAudio(ttsData.audio_url);
+        await playAudio(result.stream_url);
 
     } catch (error) {
         console.error("TTS error:", error);
@@ -431,7 +502,7 @@ async function playAudio(audioUrl) {
         }
 
         isAudioPlaying = true;
-        const audioPlayer = new Audio(audioUrl);
+        const audioPlayer = new Audio(audioSource(audioUrl));
         currentAudioPlayer = audioPlayer;
 
         audioPlayer.addEventListener('ended', () => {
@@ -447,6 +518,12 @@ async function playAudio(audioUrl) {
             console.error("Audio playback error:", e);
             isAudioPlaying = false;
             currentAudioPlayer = null;
+            // Pre-rendered audio may have been cleaned up; synthesize it live instead
+            if (messageQueue[0]?.fallbackText) {
+                messageQueue[0] = messageQueue[0].fallbackText;
+                setTimeout(processNextInQueue, 100);
+                return;
+            }
             messageQueue.shift();
             if (messageQueue.length > 0) {
                 setTimeout(processNextInQueue, 100);
@@ -536,6 +613,18 @@ async function tryLoadBackground() {
     }
 }
 
+function warmVoiceModel() {
+    // Load the voice model server-side before the first reply needs it
+    if (!audioEnabled) return;
+    fetch('/v1/tts/warm', {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+            character_id: character.id
+        })
+    }).catch(error => console.warn("Voice warm-up failed:", error));
+}
+
 async function initializeUI() {
     try {
         if (!await checkAuth()) {
@@ -547,6 +636,7 @@ async function initializeUI() {
         document.getElementById("character-description").textContent = character.description;
         
         initializeParameters();
+        warmVoiceModel();
 
         const avatarContainer = document.createElement("div");
         avatarContainer.className = "chat-header-avatar";
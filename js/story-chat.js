@@ -11,6 +11,13 @@ let lastSpeakerId = null;
 const sessionId = window.location.pathname.split('/').pop();
 let story = null; 
 
+// Ask for Opus where the browser plays it (a fraction of the WAV size), else MP3
+const AUDIO_FORMAT = new Audio().canPlayType('audio/ogg; codecs="opus"') ? 'opus' : 'mp3';
+
+function audioSource(audioUrl) {
+    return `${audioUrl}${audioUrl.includes('?') ? '&' : '?'}format=${AUDIO_FORMAT}`;
+}
+
 // Endless mode state
 let endlessModeSettings = {
     delay: 5,
@@ -945,7 +952,7 @@ async function playAudio(response) {
         const audioData = await ttsResponse.json();
         
         await new Promise((resolve, reject) => {
-            const audio = new Audio(audioData.audio_url);
+            const audio = new Audio(audioSource(audioData.audio_url));
             currentAudioPlayer = audio;
             audio.onended = resolve;
             audio.onerror = reject;
@@ -0,0 +1,264 @@
+# kobold_client.py
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+# (connect, read) timeouts in seconds, per KoboldCPP endpoint
+DEFAULT_TIMEOUT = (3.05, 30)
+ENDPOINT_TIMEOUTS = {
+    '/v1/chat/completions': (3.05, 120),
+    '/api/v1/model': (1, 3),
+    '/api/v1/generate': (3.05, 30),
+    '/sdapi/v1/txt2img': (3.05, 60),
+    '/api/extra/multiplayer/getstory': (3.05, 10),
+    '/api/extra/multiplayer/setstory': (3.05, 10),
+}
+
+# Safe to send twice; other methods are only retried if they never left
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+def never_sent(error):
+    """Whether a ConnectionError happened before the request reached the server"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+class KoboldClient:
+    """Shared keep-alive HTTP client for every call to the KoboldCPP backend"""
+
+    def __init__(self, base_url, pool_size=10, max_retries=2, retry_backoff=0.2):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        # One slot per pooled connection; time spent waiting here is pool wait
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._requests = 0
+        self._retries = 0
+        self._errors = 0
+        self._pool_wait_total = 0.0
+        self._pool_wait_max = 0.0
+
+        # Optional KoboldHealthMonitor fed with connection outcomes
+        self.health = None
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def request(self, method, path, timeout=None, track_health=True, **kwargs):
+        """Send a request to KOBOLD_API + path, retrying connection errors with jitter.
+
+        GETs retry any connection error. POSTs only retry failures to
+        connect, since a connection dropped after the body was sent may
+        already have started a generation. A streamed response keeps its
+        pool slot until it is closed, so callers must close it.
+
+        With track_health, 2xx responses count as successes for the health
+        monitor and 5xx responses or connection errors as failures; 4xx
+        responses say nothing about the backend and aren't counted.
+        """
+        url = f"{self.base_url}{path}"
+        if timeout is None:
+            timeout = ENDPOINT_TIMEOUTS.get(path, DEFAULT_TIMEOUT)
+
+        wait_start = time.perf_counter()
+        self._slots.acquire()
+        waited = time.perf_counter() - wait_start
+        with self._stats_lock:
+            self._in_flight += 1
+            self._requests += 1
+            self._pool_wait_total += waited
+            self._pool_wait_max = max(self._pool_wait_max, waited)
+
+        released = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = self._session.request(method, url, timeout=timeout, **kwargs)
+                    if self.health and track_health:
+                        if response.ok:
+                            self.health.record_success()
+                        elif response.status_code >= 500:
+                            self.health.record_failure()
+                    if kwargs.get('stream'):
+                        # The connection stays busy until the body is read, so
+                        # hold the slot until the caller closes the response
+                        self._release_on_close(response)
+                        released = True
+                    return response
+                except requests.ConnectionError as e:
+                    if attempt == self.max_retries or not (method.upper() in IDEMPOTENT_METHODS or never_sent(e)):
+                        if self.health and track_health:
+                            self.health.record_failure()
+                        raise
+                    with self._stats_lock:
+                        self._retries += 1
+                    # Exponential backoff with full jitter
+                    time.sleep(random.uniform(0, self.retry_backoff * (2 ** attempt)))
+        except Exception:
+            with self._stats_lock:
+                self._errors += 1
+            raise
+        finally:
+            if not released:
+                self._release()
+
+    def _release(self):
+        with self._stats_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _release_on_close(self, response):
+        close = response.close
+        lock = threading.Lock()
+        closed = []
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                with lock:
+                    first = not closed
+                    closed.append(True)
+                if first:
+                    self._release()
+        response.close = close_and_release
+
+    def get_stats(self):
+        """Get current client statistics"""
+        with self._stats_lock:
+            return {
+                'base_url': self.base_url,
+                'pool_size': self.pool_size,
+                'in_flight': self._in_flight,
+                'requests': self._requests,
+                'retries': self._retries,
+                'errors': self._errors,
+                'pool_wait_total_ms': round(self._pool_wait_total * 1000, 3),
+                'pool_wait_avg_ms': round(self._pool_wait_total * 1000 / self._requests, 3) if self._requests else 0,
+                'pool_wait_max_ms': round(self._pool_wait_max * 1000, 3)
+            }
+
+
+class KoboldHealthMonitor:
+    """Background prober that caches KoboldCPP liveness behind a circuit breaker.
+
+    The breaker opens after failure_threshold consecutive failures (failed
+    probes, 5xx responses or connection errors), so routes can fail fast
+    instead of each waiting on a TCP timeout. Once it has been open for
+    reset_timeout seconds it goes half-open and allow_request() lets one
+    trial request through; the trial's outcome closes the breaker or opens
+    it again. Any success, probe or trial, closes it.
+    """
+
+    def __init__(self, client, interval=5, failure_threshold=2, reset_timeout=None):
+        self.client = client
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout if reset_timeout is not None else interval
+        self._lock = threading.Lock()
+        self._state = 'open'  # Until the first success; 'closed', 'open' or 'half_open'
+        self._trial_started = None
+        self._model = None
+        self._consecutive_failures = 0
+        self._last_checked = None
+        self._opened_at = None
+
+        client.health = self
+        self._thread = threading.Thread(target=self._probe_loop, name="kobold-health", daemon=True)
+        self._thread.start()
+
+    def is_available(self):
+        """Cached liveness flag; never touches the network"""
+        return self._state == 'closed'
+
+    def allow_request(self):
+        """Whether a route may call Kobold now; admits one trial at a time while half-open"""
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            now = time.time()
+            if self._state == 'open':
+                if self._opened_at is not None and now - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = 'half_open'
+                self._trial_started = now
+                return True
+            # Half-open: a trial that never reported back frees the slot after reset_timeout
+            if now - self._trial_started >= self.reset_timeout:
+                self._trial_started = now
+                return True
+            return False
+
+    def record_success(self, model=None):
+        with self._lock:
+            self._consecutive_failures = 0
+            if self._state != 'closed':
+                print("KoboldCPP backend is available")
+            self._state = 'closed'
+            self._opened_at = None
+            self._trial_started = None
+            if model is not None:
+                self._model = model
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == 'half_open':
+                print("KoboldCPP trial request failed, reopening circuit")
+                self._open()
+            elif self._state == 'closed' and self._consecutive_failures >= self.failure_threshold:
+                print("KoboldCPP backend unreachable, opening circuit")
+                self._open()
+
+    def _open(self):
+        """Caller holds _lock"""
+        self._state = 'open'
+        self._opened_at = time.time()
+        self._trial_started = None
+
+    def probe(self):
+        """Check /api/v1/model once and update the breaker"""
+        try:
+            # The probe judges its own response; the client shouldn't count it too
+            response = self.client.get('/api/v1/model', track_health=False)
+            self._last_checked = time.time()
+            if response.ok:
+                self.record_success(response.json().get('result'))
+            else:
+                self.record_failure()
+        except Exception:
+            self._last_checked = time.time()
+            self.record_failure()
+
+    def get_status(self):
+        """Get current health state"""
+        with self._lock:
+            return {
+                'available': self._state == 'closed',
+                'state': self._state,
+                'model': self._model,
+                'consecutive_failures': self._consecutive_failures,
+                'last_checked': time.ctime(self._last_checked) if self._last_checked else None,
+                'circuit_opened_at': time.ctime(self._opened_at) if self._opened_at else None
+            }
+
+    def _probe_loop(self):
+        while True:
+            self.probe()
+            time.sleep(self.interval)
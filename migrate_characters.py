@@ -0,0 +1,20 @@
+# migrate_characters.py
+# One-shot import of the characters/*.json files into the character table,
+# which is now the only place characters are stored. Safe to re-run: rows
+# are overwritten from the files. The files are left in place as a backup.
+# Run with: python migrate_characters.py [--default-creator USER_ID] [directory]
+import argparse
+from webserver import app, character_store, CHARACTER_FOLDER
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import character JSON files into the database")
+    parser.add_argument('directory', nargs='?', default=CHARACTER_FOLDER)
+    parser.add_argument('--default-creator', help="User id to own characters whose file names no creator")
+    args = parser.parse_args()
+
+    with app.app_context():
+        imported, failed = character_store.import_files(args.directory, default_creator=args.default_creator)
+
+    print(f"Imported {len(imported)} characters from {args.directory}")
+    for filename, error in failed.items():
+        print(f"Skipped {filename}: {error}")
@@ -1,102 +1,319 @@
 # model_cache.py
 import os
+import json
 import time
 import uuid
-from threading import Lock, Timer
-import weakref
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from threading import Lock, Thread, Condition
 from tts_with_rvc import TTS_RVC
 
+class ModelPool:
+    """Interchangeable TTS_RVC instances for one character"""
+
+    def __init__(self, instance_bytes, lock):
+        self.idle = []  # (instance, released_at), most recently released last
+        self.total = 0  # Instances created, idle or checked out
+        self.instance_bytes = instance_bytes
+        self.available = Condition(lock)  # Signalled on release or removal
+
+    @property
+    def resident_bytes(self):
+        return self.total * self.instance_bytes
+
+    @property
+    def in_use(self):
+        return self.total - len(self.idle)
+
 class RVCModelCache:
     _instance = None
-    
+
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self, cache_timeout=1800, base_model_path="/root/models", input_dir="/root/input/", output_dir="/root/output/"):
+    def __init__(self, cache_timeout=1800, base_model_path="/root/models", input_dir="/root/input/", output_dir="/root/output/",
+                 max_models=None, max_bytes=None, max_instances_per_model=2, shrink_after=120):
         # Only initialize if this is the first time
         if not hasattr(self, '_initialized'):
-            self._cache = {}
+            self._cache = OrderedDict()  # character_id -> ModelPool, least recently used first
             self._last_used = {}
-            self._locks = {}
-            self._timers = {}
+            self._locks = {}  # Per-character locks serializing the first load
             self._cache_timeout = cache_timeout
             self._global_lock = Lock()
             self._base_model_path = base_model_path
             self._input_dir = input_dir
             self._output_dir = output_dir
+            # Capacity policy; None means unbounded. Least recently used
+            # models are evicted once either limit is exceeded
+            self._max_models = max_models
+            self._max_bytes = max_bytes
+            # A busy character grows up to this many instances; extras idle
+            # for shrink_after seconds are dropped again
+            self._max_instances_per_model = max_instances_per_model
+            self._shrink_after = shrink_after
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+            # Request counts per character, persisted so the most popular
+            # models can be preloaded on the next start
+            self._request_counts = Counter()
+            self._popularity_file = os.path.join(base_model_path, "popularity.json")
+            self._popularity_dirty = False  # Counts changed since the last save
+            self._warming = set()  # Characters with a warm-up in flight
             self._initialized = True
+
+            # Single background reaper expires idle models
+            self._reaper = Thread(target=self._reap_idle_models, name="rvc-cache-reaper", daemon=True)
+            self._reaper.start()
             print("RVC Model Cache initialized with priority queue support")
 
-    def get_model(self, character_id, edge_voice=None):
-        """Get a cached TTS_RVC model or create a new one"""
+    @contextmanager
+    def checkout(self, character_id, edge_voice=None):
+        """Borrow a TTS_RVC instance for one synthesis.
+
+        The instance is exclusive to the caller until the block exits, so
+        the voice set here can't leak into another request.
+        """
+        pool, instance = self._acquire(character_id)
+        try:
+            if edge_voice:
+                instance.set_voice(edge_voice)
+            yield instance
+        finally:
+            self._release(character_id, pool, instance)
+
+    def synthesize(self, character_id, text, output_path, edge_voice=None, pitch=0, tts_rate=0):
+        """Render text with a character's voice into output_path"""
+        with self.checkout(character_id, edge_voice) as tts:
+            tts(
+                text=text,
+                pitch=pitch,
+                tts_rate=tts_rate,
+                output_filename=output_path
+            )
+
+    def warm(self, character_id):
+        """Load a character's model in the background if it isn't cached yet"""
         with self._global_lock:
-            if character_id not in self._locks:
-                self._locks[character_id] = Lock()
+            if not character_id or character_id in self._cache or character_id in self._warming:
+                return False
+            self._warming.add(character_id)
+        Thread(target=self._warm_model, args=(character_id,), name=f"rvc-warm-{character_id}", daemon=True).start()
+        return True
 
-        with self._locks[character_id]:
-            current_time = time.time()
-            
-            # Return existing model if cached
-            if character_id in self._cache:
-                print(f"Using cached model for character {character_id}")
-                self._last_used[character_id] = current_time
-                
-                # Reset cleanup timer
-                if character_id in self._timers:
-                    self._timers[character_id].cancel()
-                self._timers[character_id] = Timer(
-                    self._cache_timeout, 
-                    self._cleanup_model, 
-                    args=[character_id]
-                )
-                self._timers[character_id].start()
-                
-                model = self._cache[character_id]
-                if edge_voice:
-                    model.set_voice(edge_voice)
-                return model
-
-            # Create new model instance
+    def has_model(self, character_id):
+        """Whether a character's model and index files are on disk"""
+        return all(os.path.exists(path) for path in self._model_paths(character_id))
+
+    def model_version(self, character_id):
+        """Modification time and size of the model files, or None if missing"""
+        try:
+            stats = [os.stat(path) for path in self._model_paths(character_id)]
+        except OSError:
+            return None
+        return '-'.join(f"{stat.st_mtime_ns}:{stat.st_size}" for stat in stats)
+
+    def _warm_model(self, character_id):
+        try:
+            if self.has_model(character_id):
+                print(f"Warming model for character {character_id}")
+                pool, instance = self._acquire(character_id, count=False)
+                self._release(character_id, pool, instance)
+        except Exception as e:
+            print(f"Error warming model for {character_id}: {e}")
+        finally:
+            with self._global_lock:
+                self._warming.discard(character_id)
+
+    def popular_models(self, limit):
+        """Most requested characters, most popular first"""
+        with self._global_lock:
+            return [character_id for character_id, _ in self._request_counts.most_common(limit)]
+
+    def request_count(self, character_id):
+        with self._global_lock:
+            return self._request_counts.get(character_id, 0)
+
+    def preload_popular(self, limit):
+        """Warm the top models from the saved request counts, e.g. at startup"""
+        self._load_popularity()
+        if self._max_models is not None:
+            limit = min(limit, self._max_models)
+        for character_id in self.popular_models(limit):
+            self.warm(character_id)
+
+    def _load_popularity(self):
+        try:
+            if os.path.exists(self._popularity_file):
+                with open(self._popularity_file, 'r') as f:
+                    counts = json.load(f)
+                with self._global_lock:
+                    self._request_counts.update(counts)
+        except Exception as e:
+            print(f"Error loading model popularity: {e}")
+
+    def _save_popularity(self):
+        with self._global_lock:
+            if not self._popularity_dirty:
+                return
+            counts = dict(self._request_counts)
+            self._popularity_dirty = False
+        try:
+            temp_file = f"{self._popularity_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(counts, f)
+            os.replace(temp_file, self._popularity_file)
+        except Exception:
+            with self._global_lock:
+                self._popularity_dirty = True
+            raise
+
+    def _acquire(self, character_id, count=True):
+        """Take an idle instance, growing the pool or loading the model as needed.
+
+        Only requests that got an instance count towards popularity, so
+        ids without a loadable model never reach the preload list.
+        """
+        pool, instance = self._take_instance(character_id)
+        if count:
+            with self._global_lock:
+                self._request_counts[character_id] += 1
+                self._popularity_dirty = True
+        return pool, instance
+
+    def _take_instance(self, character_id):
+        while True:
+            with self._global_lock:
+                pool = self._cache.get(character_id)
+                if pool is not None:
+                    self._cache.move_to_end(character_id)
+                    self._last_used[character_id] = time.time()
+                    self._hits += 1
+                    while self._cache.get(character_id) is pool:
+                        if pool.idle:
+                            return pool, pool.idle.pop()[0]
+                        if pool.total < self._max_instances_per_model:
+                            pool.total += 1  # Reserve the slot before building outside the lock
+                            break
+                        pool.available.wait()
+                    else:
+                        continue  # Pool was evicted while we waited; start over
+                else:
+                    character_lock = self._locks.setdefault(character_id, Lock())
+
+            if pool is not None:
+                # Grow the pool with one more instance
+                try:
+                    instance = self._create_instance(character_id)
+                except Exception:
+                    with self._global_lock:
+                        pool.total -= 1
+                        pool.available.notify()
+                    raise
+                with self._global_lock:
+                    self._evict_over_capacity(keep=character_id)
+                return pool, instance
+
+            with character_lock:
+                # Another caller may have loaded it while we waited
+                with self._global_lock:
+                    if character_id in self._cache:
+                        continue
+
+                instance = self._create_instance(character_id)
+                with self._global_lock:
+                    self._misses += 1
+                    pool = ModelPool(self._estimate_model_bytes(character_id), self._global_lock)
+                    pool.total = 1
+                    self._cache[character_id] = pool
+                    self._last_used[character_id] = time.time()
+                    self._evict_over_capacity(keep=character_id)
+                return pool, instance
+
+    def _release(self, character_id, pool, instance):
+        """Return an instance to its pool, or drop it if the pool was evicted"""
+        with self._global_lock:
+            if self._cache.get(character_id) is pool:
+                pool.idle.append((instance, time.time()))
+                pool.available.notify()
+                # Busy pools are skipped by eviction; catch up once one frees
+                if pool.in_use == 0:
+                    self._evict_over_capacity()
+
+    def _model_paths(self, character_id):
+        model_path = os.path.join(self._base_model_path, character_id, f"{character_id}.pth")
+        index_path = os.path.join(self._base_model_path, character_id, f"{character_id}.index")
+        return model_path, index_path
+
+    def _create_instance(self, character_id):
+        """Load a new TTS_RVC instance for a character"""
+        try:
+            model_path, index_path = self._model_paths(character_id)
+
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"Model file not found: {model_path}")
+            if not os.path.exists(index_path):
+                raise FileNotFoundError(f"Index file not found: {index_path}")
+
+            print(f"Creating new TTS_RVC instance for character {character_id}")
+            return TTS_RVC(
+                rvc_path="src/rvclib",
+                model_path=model_path,
+                input_directory=self._input_dir,
+                index_path=index_path
+            )
+
+        except Exception as e:
+            print(f"Error creating TTS_RVC instance for {character_id}: {str(e)}")
+            raise
+
+    def _estimate_model_bytes(self, character_id):
+        """Estimate resident size of one instance from the weights and index on disk"""
+        return sum(os.path.getsize(path) for path in self._model_paths(character_id))
+
+    def _resident_bytes(self):
+        return sum(pool.resident_bytes for pool in self._cache.values())
+
+    def _evict_over_capacity(self, keep=None):
+        """Drop least recently used idle models until within capacity. Caller holds _global_lock.
+
+        Models with instances checked out are skipped, since their memory
+        isn't freed until release; _release() retries eviction then.
+        """
+        for character_id, pool in list(self._cache.items()):
+            over_count = self._max_models is not None and len(self._cache) > self._max_models
+            over_bytes = self._max_bytes is not None and self._resident_bytes() > self._max_bytes
+            if not (over_count or over_bytes):
+                break
+            if character_id == keep or pool.in_use > 0:
+                continue
+            print(f"Evicting model for character {character_id} (cache over capacity)")
+            self._remove_model(character_id)
+            self._evictions += 1
+
+    def _reap_idle_models(self):
+        """Reaper loop: drop idle models and shrink pools that grew under load"""
+        while True:
+            time.sleep(min(60, self._cache_timeout / 4, self._shrink_after / 2))
             try:
-                model_path = os.path.join(self._base_model_path, character_id, f"{character_id}.pth")
-                index_path = os.path.join(self._base_model_path, character_id, f"{character_id}.index")
-
-                if not os.path.exists(model_path):
-                    raise FileNotFoundError(f"Model file not found: {model_path}")
-                if not os.path.exists(index_path):
-                    raise FileNotFoundError(f"Index file not found: {index_path}")
-
-                print(f"Creating new TTS_RVC instance for character {character_id}")
-                tts_instance = TTS_RVC(
-                    rvc_path="src/rvclib",
-                    model_path=model_path,
-                    input_directory=self._input_dir,
-                    index_path=index_path
-                )
-                
-                if edge_voice:
-                    tts_instance.set_voice(edge_voice)
-
-                # Store with weak reference
-                
-                self._cache[character_id] = tts_instance
-                self._last_used[character_id] = current_time
-                
-                # Set cleanup timer
-                self._timers[character_id] = Timer(
-                    self._cache_timeout, 
-                    self._cleanup_model, 
-                    args=[character_id]
-                )
-                self._timers[character_id].start()
-                
-                return tts_instance
+                now = time.time()
+                with self._global_lock:
+                    for character_id, pool in list(self._cache.items()):
+                        if self._last_used[character_id] < now - self._cache_timeout and pool.in_use == 0:
+                            print(f"Cleaning up unused model for character {character_id}")
+                            self._remove_model(character_id)
+                            continue
 
+                        # Keep one warm instance; drop extras idle past shrink_after
+                        shrink_cutoff = now - self._shrink_after
+                        while pool.total > 1 and pool.idle and pool.idle[0][1] < shrink_cutoff:
+                            pool.idle.pop(0)
+                            pool.total -= 1
+                self._save_popularity()
             except Exception as e:
-                print(f"Error creating TTS_RVC instance for {character_id}: {str(e)}")
-                raise
+                print(f"Error in model cache reaper: {e}")
 
     def handle_queued_request(self, data):
         """Handler function for queue system"""
@@ -107,20 +324,19 @@ class RVCModelCache:
             tts_rate = data.get("tts_rate", 0)
             rvc_pitch = data.get("rvc_pitch", 0)
 
-            # Get or create model instance
-            tts = self.get_model(character_id, edge_voice)
-            
             # Generate unique filename
             unique_id = str(uuid.uuid4())
             output_filename = f"response_{unique_id}.wav"
             output_path = os.path.join(self._output_dir, output_filename)
 
             print(f"Generating audio for queued request (character: {character_id})")
-            tts(
-                text=text,
+            self.synthesize(
+                character_id,
+                text,
+                output_path,
+                edge_voice=edge_voice,
                 pitch=rvc_pitch,
-                tts_rate=tts_rate,
-                output_filename=output_path
+                tts_rate=tts_rate
             )
 
             if not os.path.exists(output_path):
@@ -136,20 +352,25 @@ class RVCModelCache:
 
     def _cleanup_model(self, character_id):
         """Clean up an unused model"""
-        with self._locks[character_id]:
+        with self._global_lock:
             if character_id in self._cache:
                 print(f"Cleaning up unused model for character {character_id}")
-                del self._cache[character_id]
-                del self._last_used[character_id]
-                if character_id in self._timers:
-                    self._timers[character_id].cancel()
-                    del self._timers[character_id]
+                self._remove_model(character_id)
+
+    def _remove_model(self, character_id):
+        """Forget a cached model. Caller holds _global_lock."""
+        pool = self._cache.pop(character_id, None)
+        self._last_used.pop(character_id, None)
+        if pool is not None:
+            # Checked-out instances are dropped on release; wake any waiters
+            pool.available.notify_all()
 
     def clear_cache(self):
         """Clear all cached models"""
         with self._global_lock:
-            for character_id in list(self._cache.keys()):
-                self._cleanup_model(character_id)
+            character_ids = list(self._cache.keys())
+        for character_id in character_ids:
+            self._cleanup_model(character_id)
 
     def get_cache_stats(self):
         """Get current cache statistics"""
@@ -157,7 +378,17 @@ class RVCModelCache:
             return {
                 'cached_models': len(self._cache),
                 'models': list(self._cache.keys()),
-                'last_used': {k: time.ctime(v) for k, v in self._last_used.items()}
+                'instances': {k: {'total': p.total, 'in_use': p.in_use} for k, p in self._cache.items()},
+                'last_used': {k: time.ctime(v) for k, v in self._last_used.items()},
+                'resident_bytes': self._resident_bytes(),
+                'max_models': self._max_models,
+                'max_bytes': self._max_bytes,
+                'max_instances_per_model': self._max_instances_per_model,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'warming': list(self._warming),
+                'popular': self._request_counts.most_common(10)
             }
 
 # Create global instance
@@ -166,4 +397,4 @@ model_cache = RVCModelCache()
 # Queue handler function for TTS
 def tts_handler(data):
     """TTS handler function for queue system"""
-    return model_cache.handle_queued_request(data)
\ No newline at end of file
+    return model_cache.handle_queued_request(data)
@@ -1,9 +1,12 @@
-from collections import deque
+from collections import deque, OrderedDict
+import heapq
 import threading
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from queue import Queue
 from typing import Dict, Optional, Callable
 import uuid
+from concurrent.futures import wait as wait_futures
 
 @dataclass
 class QueuedRequest:
@@ -14,26 +17,177 @@ class QueuedRequest:
     timestamp: float
     status: str = 'pending'
     result: Optional[dict] = None
-    position: int = 0
+    sequence: int = 0  # Monotonic enqueue number within its user's queue
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+    chunks: Optional[Queue] = field(default=None, repr=False)  # Set for streaming requests
+    on_done: Optional[Callable[[str, dict], None]] = field(default=None, repr=False)  # Called with the id and final status
+
+# Default share of dispatches per request type; TTS finishes a reply the
+# user is already waiting on, so it gets twice the share of chat
+DEFAULT_WEIGHTS = {
+    'chat': 1,
+    'tts': 2
+}
+
+class FairScheduler:
+    """Weighted round-robin across request types, round-robin across users.
+
+    Not thread-safe on its own; RequestQueue calls it under its lock.
+    """
+
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = dict(weights)
+        self.credit = {request_type: 0 for request_type in self.weights}
+        # Per type: user_id -> deque of that user's requests, in service order
+        self.users = {request_type: OrderedDict() for request_type in self.weights}
+        # Per (type, user) counters, dropped when the user's queue drains
+        self.enqueued = {}
+        self.dequeued = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, request: 'QueuedRequest'):
+        """Queue a request behind the same user's earlier requests."""
+        users = self.users[request.request_type]
+        key = (request.request_type, request.user_id)
+        if request.user_id not in users:
+            users[request.user_id] = deque()
+            self.enqueued[key] = 0
+            self.dequeued[key] = 0
+        self.enqueued[key] += 1
+        request.sequence = self.enqueued[key]
+        users[request.user_id].append(request)
+        self.size += 1
+
+    def pop(self) -> Optional['QueuedRequest']:
+        """Take the next request, or None if nothing is queued."""
+        request_type = self._next_type()
+        if request_type is None:
+            return None
+
+        # Serve the user at the head of the ring, then rotate them to the back
+        user_id = next(iter(self.users[request_type]))
+        return self._take(request_type, user_id)
+
+    def pop_matching(self, request_type: str, matches: Callable[['QueuedRequest'], bool]) -> Optional['QueuedRequest']:
+        """Take the first user's next request of this type that matches, in ring order."""
+        for user_id, user_queue in self.users[request_type].items():
+            if matches(user_queue[0]):
+                return self._take(request_type, user_id)
+        return None
+
+    def _take(self, request_type: str, user_id: str) -> 'QueuedRequest':
+        """Pop a user's next request and rotate them to the back of the ring."""
+        users = self.users[request_type]
+        user_queue = users[user_id]
+        request = user_queue.popleft()
+        key = (request_type, user_id)
+        if user_queue:
+            users.move_to_end(user_id)
+            self.dequeued[key] += 1
+        else:
+            del users[user_id]
+            del self.enqueued[key]
+            del self.dequeued[key]
+        self.size -= 1
+        return request
+
+    def position(self, request: 'QueuedRequest') -> int:
+        """Effective 1-based position of a queued request within its type.
+
+        Under round-robin, every other user with a request still queued
+        gets one turn per round ahead of this request, so the cost is
+        O(active users of that type) rather than O(queued requests).
+        """
+        users = self.users[request.request_type]
+        rounds = request.sequence - self.dequeued[(request.request_type, request.user_id)]
+        position = rounds
+        ahead_in_ring = True
+        for user_id, user_queue in users.items():
+            if user_id == request.user_id:
+                ahead_in_ring = False
+                continue
+            position += min(len(user_queue), rounds if ahead_in_ring else rounds - 1)
+        return position
+
+    def _next_type(self) -> Optional[str]:
+        """Smooth weighted round-robin over request types with work queued."""
+        ready = [request_type for request_type, users in self.users.items() if users]
+        if not ready:
+            return None
+        total = 0
+        for request_type in ready:
+            self.credit[request_type] += self.weights[request_type]
+            total += self.weights[request_type]
+        chosen = max(ready, key=lambda request_type: self.credit[request_type])
+        self.credit[chosen] -= total
+        return chosen
+
+@dataclass
+class BatchConfig:
+    handler: Callable  # list of request data -> one concurrent.futures.Future per request
+    key: Callable  # request data -> hashable; only equal keys share a batch
+    window: float  # Seconds to wait for companions after the first request
+    max_batch: int
 
 class RequestQueue:
-    def __init__(self, max_concurrent: int = 5):
-        self.chat_queue = deque()
-        self.tts_queue = deque()
+    def __init__(self, max_concurrent: int = 5, result_ttl: float = 30, max_results: int = 10000,
+                 weights: Optional[Dict[str, int]] = None):
+        self.scheduler = FairScheduler(weights or DEFAULT_WEIGHTS)
         self.processing = {}  # Currently processing requests
+        self.requests = {}  # Every known request by id, queued or not
+
+        # Finished requests stay readable for result_ttl seconds, capped at
+        # max_results entries; expiry order is kept in a min-heap
+        self.results = {}
+        self.result_expiry = []  # (expires_at, request_id)
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+
         self.max_concurrent = max_concurrent
         self.lock = threading.Lock()
-        self.processing_thread = threading.Thread(target=self._process_queues, daemon=True)
-        self.processing_thread.start()
-        
+
+        # Idle workers sleep on this until add_request has something for them
+        self.not_empty = threading.Condition(self.lock)
+        # Workers holding a partial batch wait on this for companions
+        self.batch_arrival = threading.Condition(self.lock)
+        self.collecting = []  # (request_type, batch key) per worker holding a partial batch
+        self.reaper_condition = threading.Condition(self.lock)
+
         # Handlers for different request types
         self.handlers = {
             'chat': None,
             'tts': None
         }
+        self.stream_handlers = {}  # request_type -> handler(data, emit)
+        self.batching = {}  # request_type -> BatchConfig
+
+        # Shared pool of max_concurrent workers; the scheduler decides
+        # which request type and which user each free worker serves next
+        self.workers = []
+        for i in range(max_concurrent):
+            worker = threading.Thread(target=self._worker, name=f"queue-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+        # Single reaper thread expires finished results
+        self.reaper_thread = threading.Thread(target=self._reap_results, name="queue-reaper", daemon=True)
+        self.reaper_thread.start()
 
-    def add_request(self, user_id: str, request_type: str, data: dict) -> str:
-        """Add a new request to the appropriate queue."""
+    def add_request(self, user_id: str, request_type: str, data: dict, stream: bool = False,
+                    on_done: Optional[Callable[[str, dict], None]] = None) -> str:
+        """Add a new request to the appropriate queue.
+
+        With stream=True the request runs through the type's stream handler
+        and its output can be read chunk by chunk with stream(). on_done is
+        called with the request id and final status, for callers that need
+        the result for longer than result_ttl. Raises ValueError for a
+        request type the scheduler has no lane for.
+        """
+        if request_type not in self.scheduler.weights:
+            raise ValueError(f'No handler for {request_type}')
         with self.lock:
             request_id = str(uuid.uuid4())
             request = QueuedRequest(
@@ -41,102 +195,262 @@ class RequestQueue:
                 user_id=user_id,
                 request_type=request_type,
                 data=data,
-                timestamp=time.time()
+                timestamp=time.time(),
+                chunks=Queue() if stream else None,
+                on_done=on_done
             )
             
-            queue = self.tts_queue if request_type == 'tts' else self.chat_queue
-            queue.append(request)
-            self._update_positions(queue)
+            self.scheduler.push(request)
+            self.requests[request_id] = request
+            # A collecting worker will take it, so don't wake an idle one to race it
+            if not self._joins_batch(request):
+                self.not_empty.notify()
+            if self.batching:
+                self.batch_arrival.notify_all()
             
             return request_id
 
     def get_status(self, request_id: str) -> Optional[dict]:
         """Get the current status of a request."""
-        # Check processing requests first
-        if request_id in self.processing:
-            request = self.processing[request_id]
+        with self.lock:
+            request = self._find_request(request_id)
+            if request is None:
+                return None
+            return self._status_of(request)
+
+    def wait_for(self, request_id: str, timeout: Optional[float] = None) -> Optional[dict]:
+        """Block until a request finishes or timeout expires, then return its status."""
+        with self.lock:
+            request = self._find_request(request_id)
+        if request is None:
+            return None
+
+        request.done.wait(timeout)
+        with self.lock:
+            return self._status_of(request)
+
+    def stream(self, request_id: str, timeout: Optional[float] = None):
+        """Yield a streaming request's chunks as the handler emits them.
+
+        Ends when the handler finishes; check get_status afterwards for the
+        outcome. Raises queue.Empty if no chunk arrives within timeout.
+        """
+        with self.lock:
+            request = self._find_request(request_id)
+        if request is None or request.chunks is None:
+            return
+
+        while True:
+            chunk = request.chunks.get(timeout=timeout)
+            if chunk is None:
+                return
+            yield chunk
+
+    def _joins_batch(self, request: QueuedRequest) -> bool:
+        """Whether a worker collecting a batch wants this request. Caller must hold self.lock."""
+        batch_config = self.batching.get(request.request_type)
+        if not self.collecting or batch_config is None or request.chunks is not None:
+            return False
+        try:
+            return (request.request_type, batch_config.key(request.data)) in self.collecting
+        except Exception:
+            return False  # A worker will pop it and fail it
+
+    def _find_request(self, request_id: str) -> Optional[QueuedRequest]:
+        """Look up a queued or processing request. Caller must hold self.lock."""
+        return self.requests.get(request_id)
+
+    def _status_of(self, request: QueuedRequest) -> dict:
+        """Build the status dict returned to callers."""
+        if request.status == 'pending':
             return {
-                'status': request.status,
-                'position': 0,
-                'result': request.result
+                'status': 'queued',
+                'position': self._position_of(request)
             }
-            
-        # Check queues
-        for queue in [self.chat_queue, self.tts_queue]:
-            for request in queue:
-                if request.id == request_id:
-                    return {
-                        'status': 'queued',
-                        'position': request.position
-                    }
-                    
-        return None
+        return {
+            'status': request.status,
+            'position': 0,
+            'result': request.result
+        }
+
+    def _position_of(self, request: QueuedRequest) -> int:
+        """1-based position of a pending request among its type."""
+        return self.scheduler.position(request)
 
     def register_handler(self, request_type: str, handler: Callable):
         """Register a handler function for a specific request type."""
         self.handlers[request_type] = handler
 
-    def _update_positions(self, queue: deque):
-        """Update position numbers in queue."""
-        for i, request in enumerate(queue):
-            request.position = i + 1
+    def register_stream_handler(self, request_type: str, handler: Callable):
+        """Register a handler for streaming requests.
+
+        Called as handler(data, emit); it calls emit(chunk) for each piece
+        of output and returns the final result like a regular handler.
+        """
+        self.stream_handlers[request_type] = handler
 
-    def _process_queues(self):
-        """Main processing loop for queued requests."""
+    def register_batch_handler(self, request_type: str, handler: Callable, key: Callable,
+                               window: float = 0.01, max_batch: int = 4):
+        """Enable micro-batching for a request type.
+
+        A worker that picks up a request of this type keeps collecting
+        queued requests with the same key for up to `window` seconds, then
+        passes all of their data to `handler` in one call. Requests arriving
+        meanwhile are left to that worker rather than waking an idle one. The handler
+        returns one Future per input. Each request finishes as soon as its
+        own future does, so a fast reply never waits on a slow one, and a
+        failed future fails only its own request.
+        """
+        self.batching[request_type] = BatchConfig(handler, key, window, max_batch)
+
+    def _worker(self):
+        """Worker loop: block until a request is queued, then run the next one."""
         while True:
+            batch = []
             try:
-                with self.lock:
-                    # Process priority queue (TTS) first
-                    if self.tts_queue and len(self.processing) < self.max_concurrent:
-                        request = self.tts_queue.popleft()
-                        self._process_request(request)
-                        self._update_positions(self.tts_queue)
-                        
-                    # Then process chat queue
-                    elif self.chat_queue and len(self.processing) < self.max_concurrent:
-                        request = self.chat_queue.popleft()
-                        self._process_request(request)
-                        self._update_positions(self.chat_queue)
-
-                time.sleep(0.1)  # Prevent CPU spinning
-                
+                with self.not_empty:
+                    while not self.scheduler:
+                        self.not_empty.wait()
+                    request = self.scheduler.pop()
+                    request.status = 'processing'
+                    self.processing[request.id] = request
+                    batch.append(request)
+
+                    batch_config = None
+                    if request.chunks is None:
+                        batch_config = self.batching.get(request.request_type)
+                    if batch_config:
+                        self._collect_batch(batch, batch_config)
+
+                # Handler runs without the lock so workers don't block each other
+                if batch_config:
+                    self._process_batch(batch, batch_config)
+                else:
+                    self._process_request(request)
+
             except Exception as e:
                 print(f"Error in queue processing: {e}")
-                time.sleep(1)  # Back off on error
+                # Don't leave anything we took stranded in processing
+                for request in batch:
+                    if request.status == 'processing':
+                        self._finish(request, e)
+
+    def _collect_batch(self, batch: list, batch_config: BatchConfig):
+        """Add requests compatible with batch[0] to batch, in place so a failure
+        leaves it complete. Caller must hold self.lock."""
+        first = batch[0]
+        batch_key = batch_config.key(first.data)
+        deadline = time.time() + batch_config.window
+        collector = (first.request_type, batch_key)
+        self.collecting.append(collector)
+        try:
+            while len(batch) < batch_config.max_batch:
+                request = self.scheduler.pop_matching(
+                    first.request_type,
+                    lambda queued: queued.chunks is None and batch_config.key(queued.data) == batch_key
+                )
+                if request:
+                    request.status = 'processing'
+                    self.processing[request.id] = request
+                    batch.append(request)
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.batch_arrival.wait(remaining)
+        finally:
+            self.collecting.remove(collector)
+            # Requests add_request left to us but we didn't take need a worker
+            if self.scheduler:
+                self.not_empty.notify()
 
     def _process_request(self, request: QueuedRequest):
         """Process a single request."""
-        handler = self.handlers.get(request.request_type)
-        if not handler:
-            request.status = 'error'
-            request.result = {'error': f'No handler for {request.request_type}'}
-            return
-
+        if request.chunks is not None:
+            handler = self.stream_handlers.get(request.request_type)
+        else:
+            handler = self.handlers.get(request.request_type)
         try:
-            self.processing[request.id] = request
-            request.status = 'processing'
-            
+            if not handler:
+                raise Exception(f'No handler for {request.request_type}')
+
             # Process the request
-            result = handler(request.data)
-            request.result = result
-            request.status = 'complete'
+            if request.chunks is not None:
+                result = handler(request.data, request.chunks.put)
+            else:
+                result = handler(request.data)
             
         except Exception as e:
+            result = e
+
+        self._finish(request, result)
+
+    def _process_batch(self, batch: list, batch_config: BatchConfig):
+        """Dispatch a batch and finish each request as its own future completes."""
+        try:
+            futures = batch_config.handler([request.data for request in batch])
+            if len(futures) != len(batch):
+                raise Exception(f'Batch handler returned {len(futures)} futures for {len(batch)} requests')
+        except Exception as e:
+            for request in batch:
+                self._finish(request, e)
+            return
+
+        for request, future in zip(batch, futures):
+            future.add_done_callback(lambda done, request=request: self._finish(request, done.exception() or done.result()))
+        # Hold this worker until the batch drains, so workers still bound concurrency
+        wait_futures(futures)
+
+    def _finish(self, request: QueuedRequest, result):
+        """Record a result (or exception) and move the request into the result store."""
+        if isinstance(result, Exception):
             request.status = 'error'
-            request.result = {'error': str(e)}
-            
-        finally:
-            # Keep completed requests in processing dict for a short time
-            # for status checks, then clean up
-            def cleanup():
-                time.sleep(30)  # Keep result for 30 seconds
-                with self.lock:
-                    self.processing.pop(request.id, None)
-                    
-            threading.Thread(target=cleanup, daemon=True).start()
+            request.result = {'error': str(result)}
+        else:
+            request.result = result
+            request.status = 'complete'
+
+        with self.lock:
+            self.processing.pop(request.id, None)
+            self.results[request.id] = request
+            heapq.heappush(self.result_expiry, (time.time() + self.result_ttl, request.id))
+            self._expire_results(time.time())
+            self.reaper_condition.notify()
+
+        # Wake anyone blocked in wait_for, and end any stream
+        request.done.set()
+        if request.chunks is not None:
+            request.chunks.put(None)
+        if request.on_done is not None:
+            try:
+                request.on_done(request.id, self._status_of(request))
+            except Exception as e:
+                print(f"Error in completion callback for {request.id}: {e}")
+
+    def _reap_results(self):
+        """Reaper loop: sleep until the oldest result expires, then drop it."""
+        with self.reaper_condition:
+            while True:
+                try:
+                    self._expire_results(time.time())
+                    timeout = None
+                    if self.result_expiry:
+                        timeout = max(self.result_expiry[0][0] - time.time(), 0)
+                    self.reaper_condition.wait(timeout)
+                except Exception as e:
+                    print(f"Error in result reaper: {e}")
+
+    def _expire_results(self, now: float):
+        """Drop results past their TTL or beyond max_results. Caller must hold self.lock."""
+        while self.result_expiry and (
+            self.result_expiry[0][0] <= now or len(self.results) > self.max_results
+        ):
+            _, request_id = heapq.heappop(self.result_expiry)
+            self.results.pop(request_id, None)
+            self.requests.pop(request_id, None)
 
 # Initialize global queue
-request_queue = RequestQueue(max_concurrent=5)
+request_queue = RequestQueue(max_concurrent=5, result_ttl=30)
 
 # Example route handlers
 def handle_chat_request(app):
@@ -161,14 +475,12 @@ def handle_chat_request(app):
                     'request_id': request_id
                 })
             
-            # Poll for completion if position is low
-            for _ in range(30):  # 30 second timeout
-                status = request_queue.get_status(request_id)
-                if status['status'] == 'complete':
-                    return jsonify(status['result'])
-                elif status['status'] == 'error':
-                    return jsonify({'error': status['result']['error']}), 500
-                time.sleep(1)
+            # Wait for completion if position is low
+            status = request_queue.wait_for(request_id, timeout=30)
+            if status['status'] == 'complete':
+                return jsonify(status['result'])
+            elif status['status'] == 'error':
+                return jsonify({'error': status['result']['error']}), 500
             
             return jsonify({'error': 'Request timeout'}), 408
             
@@ -184,6 +496,12 @@ def handle_chat_request(app):
         return jsonify(status)
 
 # Register handlers
-def setup_queue_handlers(kobold_handler, tts_handler):
+def setup_queue_handlers(kobold_handler, tts_handler, kobold_batch_handler=None, chat_batch_key=None,
+                         batch_window=0.01, max_batch=4, kobold_stream_handler=None):
     request_queue.register_handler('chat', kobold_handler)
-    request_queue.register_handler('tts', tts_handler)
\ No newline at end of file
+    request_queue.register_handler('tts', tts_handler)
+    if kobold_stream_handler:
+        request_queue.register_stream_handler('chat', kobold_stream_handler)
+    if kobold_batch_handler:
+        request_queue.register_batch_handler('chat', kobold_batch_handler, chat_batch_key,
+                                             window=batch_window, max_batch=max_batch)
\ No newline at end of file
@@ -7,6 +7,7 @@ let activeFilters = {
     categories: new Set(),
     tags: new Set(),
     search: '',
+    searchIds: null, // Ids matched by the server-side search, null to match locally
     view: 'grid',
     sort: 'random'
 };
@@ -200,7 +201,9 @@ function filterCharacters() {
         const category = char.category || '';
         const charTags = char.tags || [];
 
-        const matchesSearch = (name.toLowerCase().includes(activeFilters.search.toLowerCase()) ||
+        const matchesSearch = activeFilters.searchIds ?
+                             activeFilters.searchIds.has(char.id) :
+                             (name.toLowerCase().includes(activeFilters.search.toLowerCase()) ||
                              description.toLowerCase().includes(activeFilters.search.toLowerCase()));
                              
         const matchesCategories = !activeFilters.categories.size || 
@@ -213,6 +216,33 @@ function filterCharacters() {
     });
 }
 
+// Match the search box against the server's index, which also covers tags and prompts
+let searchTimer = null;
+function searchCharacters(query) {
+    clearTimeout(searchTimer);
+    activeFilters.search = query;
+    if (!query.trim()) {
+        activeFilters.searchIds = null;
+        updateCharacterDisplay();
+        return;
+    }
+    searchTimer = setTimeout(async () => {
+        try {
+            const params = new URLSearchParams({ q: query, fields: 'id', limit: '100' });
+            const response = await fetch(`/characters/search?${params}`, { credentials: 'include' });
+            if (!response.ok) throw new Error(`Search failed: ${response.status}`);
+            const data = await response.json();
+            // Ignore responses for a query the user has already typed past
+            if (activeFilters.search !== query) return;
+            activeFilters.searchIds = new Set(data.characters.map(char => char.id));
+        } catch (error) {
+            console.error('Error searching characters:', error);
+            activeFilters.searchIds = null;
+        }
+        updateCharacterDisplay();
+    }, 200);
+}
+
 function sortCharacters(chars) {
     const charsCopy = [...chars];
     switch (activeFilters.sort) {
@@ -312,8 +342,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     const searchInput = document.getElementById('search');
     if (searchInput) {
         searchInput.addEventListener('input', (e) => {
-            activeFilters.search = e.target.value;
-            updateCharacterDisplay();
+            searchCharacters(e.target.value);
         });
     }
 });
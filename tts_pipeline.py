@@ -0,0 +1,169 @@
+# tts_pipeline.py
+import re
+import threading
+import time
+import uuid
+
+# A sentence ends at terminal punctuation (plus closing quotes/brackets)
+# followed by whitespace, so "3.5" or a trailing "..." mid-stream don't split
+SENTENCE_END = re.compile(r'[.!?…]+["\')\]]*\s+')
+ACTION_TEXT = re.compile(r'\*[^*]*\*')
+MIN_SEGMENT_CHARS = 12  # Shorter sentences are merged into the next one
+
+def split_sentences(text):
+    """Complete sentences at the start of text, and the text left over"""
+    sentences = []
+    cut = 0
+    for match in SENTENCE_END.finditer(text):
+        candidate = text[cut:match.end()]
+        # Don't cut inside an unfinished *action* or on a tiny fragment
+        if candidate.count('*') % 2 == 0 and len(candidate.strip()) >= MIN_SEGMENT_CHARS:
+            sentences.append(candidate)
+            cut = match.end()
+    return sentences, text[cut:]
+
+def speakable(text):
+    """Text as it's sent to TTS: actions dropped, whitespace collapsed"""
+    return ' '.join(ACTION_TEXT.sub('', text).replace('*', '').split())
+
+def speech_segments(text):
+    """The segment texts a complete text is spoken as, the same split a pipeline makes"""
+    sentences, rest = split_sentences(text)
+    return [segment for segment in map(speakable, sentences + [rest]) if segment]
+
+def speech_voice(payload):
+    """Voice settings from a client payload, checked and normalized; raises ValueError"""
+    if not isinstance(payload, dict):
+        raise ValueError('tts must be an object')
+    voice = {}
+    for name in ('edge_voice', 'rvc_model'):
+        value = payload.get(name)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'{name} must be a string')
+        voice[name] = value
+    for name in ('tts_rate', 'rvc_pitch'):
+        value = payload.get(name) or 0
+        try:
+            if isinstance(value, bool):
+                raise TypeError
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{name} must be a number')
+        voice[name] = int(number) if number.is_integer() else number
+    return voice
+
+class SpeechPipeline:
+    """Turns a streamed reply into ordered TTS segments, one per sentence.
+
+    Text is fed in as tokens arrive; each completed sentence is queued as
+    its own 'tts' request, so synthesis of the first sentence starts while
+    the model is still generating the rest. Each segment's final status is
+    kept on the pipeline, so its segments can be replayed for as long as
+    the pipeline lives rather than the queue's result_ttl.
+    """
+
+    def __init__(self, request_queue, user_id, voice):
+        self.id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.voice = voice  # edge_voice, rvc_model, tts_rate, rvc_pitch
+        self.segments = []  # Queue request ids, in reply order
+        self._results = {}  # Request id -> final queue status
+        self.finished = False
+        self.finished_at = None
+        self.created_at = time.time()
+        self.charge = None  # Whatever the caller prepaid; see take_charge()
+        self._request_queue = request_queue
+        self._buffer = ''
+        self._condition = threading.Condition()
+
+    def feed(self, text):
+        """Append streamed text and queue any sentences it completes"""
+        sentences, self._buffer = split_sentences(self._buffer + text)
+        for sentence in sentences:
+            self._submit(sentence)
+
+    def finish(self):
+        """Flush the remaining text; no more segments will be added"""
+        with self._condition:
+            if self.finished:
+                return
+        self._submit(self._buffer)
+        self._buffer = ''
+        with self._condition:
+            self.finished = True
+            self.finished_at = time.time()
+            self._condition.notify_all()
+
+    def take_charge(self):
+        """Hand out the prepaid charge once, so it's settled or refunded only once"""
+        with self._condition:
+            charge, self.charge = self.charge, None
+            return charge
+
+    def iter_segments(self, timeout=None):
+        """Yield (index, status) for each segment in order as it finishes.
+
+        status is None if a segment didn't finish within timeout.
+        """
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.segments) and not self.finished:
+                    self._condition.wait()
+                if index >= len(self.segments):
+                    return
+                request_id = self.segments[index]
+                finished = self._condition.wait_for(lambda: request_id in self._results, timeout)
+                status = self._results[request_id] if finished else None
+            yield index, status
+            index += 1
+
+    def _submit(self, text):
+        text = speakable(text)
+        if not text:
+            return
+        request_id = self._request_queue.add_request(self.user_id, 'tts', dict(self.voice, text=text), on_done=self._record)
+        with self._condition:
+            self.segments.append(request_id)
+            self._condition.notify_all()
+
+    def _record(self, request_id, status):
+        with self._condition:
+            self._results[request_id] = status
+            self._condition.notify_all()
+
+class SpeechPipelineRegistry:
+    """Process-wide lookup of active pipelines, dropped a while after they finish.
+
+    Pipelines that never finish, e.g. because their stream was abandoned,
+    are dropped max_lifetime seconds after they were created.
+    """
+
+    def __init__(self, retention=300, max_lifetime=3600):
+        self._pipelines = {}
+        self._lock = threading.Lock()
+        self._retention = retention
+        self._max_lifetime = max_lifetime
+
+    def create(self, request_queue, user_id, voice):
+        pipeline = SpeechPipeline(request_queue, user_id, voice)
+        with self._lock:
+            self._expire()
+            self._pipelines[pipeline.id] = pipeline
+        return pipeline
+
+    def get(self, pipeline_id):
+        with self._lock:
+            return self._pipelines.get(pipeline_id)
+
+    def _expire(self):
+        now = time.time()
+        for pipeline_id, pipeline in list(self._pipelines.items()):
+            if pipeline.finished:
+                expired = pipeline.finished_at < now - self._retention
+            else:
+                expired = pipeline.created_at < now - self._max_lifetime
+            if expired:
+                del self._pipelines[pipeline_id]
+
+speech_pipelines = SpeechPipelineRegistry()
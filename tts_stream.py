@@ -0,0 +1,80 @@
+# tts_stream.py
+import os
+import struct
+
+STREAM_BLOCK_SIZE = 64 * 1024
+STREAM_UNKNOWN_SIZE = 0xFFFFFFFF  # RIFF/data size used when the total length isn't known yet
+
+def read_wav_layout(path):
+    """Return (fmt chunk body, data offset, data size) for a RIFF/WAVE file"""
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"Not a WAV file: {path}")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk in {path}")
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError(f"data chunk before fmt chunk in {path}")
+                offset = f.tell()
+                size = min(chunk_size, os.path.getsize(path) - offset)
+                return fmt, offset, size
+            else:
+                f.seek(chunk_size, os.SEEK_CUR)
+            if chunk_size % 2:
+                f.seek(1, os.SEEK_CUR)  # Chunks are word aligned
+
+def wav_stream_header(fmt):
+    """Header for a WAV stream of unknown length that uses the given fmt chunk"""
+    return (
+        struct.pack('<4sI4s', b'RIFF', STREAM_UNKNOWN_SIZE, b'WAVE')
+        + struct.pack('<4sI', b'fmt ', len(fmt)) + fmt
+        + struct.pack('<4sI', b'data', STREAM_UNKNOWN_SIZE)
+    )
+
+def iter_file_range(path, offset=0, size=None):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        remaining = size
+        while remaining is None or remaining > 0:
+            block = f.read(STREAM_BLOCK_SIZE if remaining is None else min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                return
+            if remaining is not None:
+                remaining -= len(block)
+            yield block
+
+class WavStreamWriter:
+    """Joins WAV segments into one continuous stream: one header, then raw samples"""
+
+    mimetype = 'audio/wav'
+
+    def __init__(self):
+        self._fmt = None
+
+    def segment(self, wav_path):
+        fmt, offset, size = read_wav_layout(wav_path)
+        if self._fmt is None:
+            self._fmt = fmt
+            yield wav_stream_header(fmt)
+        elif fmt != self._fmt:
+            # Every segment comes from the same voice, so this shouldn't happen
+            print(f"Skipping stream segment with a different sample format: {wav_path}")
+            return
+        yield from iter_file_range(wav_path, offset, size)
+
+class EncodedStreamWriter:
+    """Joins segments of a frame-based encoding (MP3) by concatenating the files"""
+
+    def __init__(self, mimetype, encode):
+        self.mimetype = mimetype
+        self._encode = encode  # wav_path -> path of the encoded copy
+
+    def segment(self, wav_path):
+        yield from iter_file_range(self._encode(wav_path))
@@ -9,7 +9,7 @@ from flask import render_template, redirect, url_for, make_response
 from datetime import datetime, timedelta
 import shutil
 import json
-from flask import Flask, request, jsonify, send_from_directory, send_file, Response, session, g
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response, session, g, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
@@ -28,10 +28,20 @@ from sqlalchemy import and_
 import time
 from queue_system import request_queue, setup_queue_handlers
 from model_cache import model_cache
+from audio_cache import audio_cache
+from audio_encoding import ENCODINGS, encoded_path, encoding_for_extension, negotiate, transcoder_available
+from tts_stream import EncodedStreamWriter, WavStreamWriter
+from audio_retention import AudioRetention
+from character_catalog import CARD_FIELDS, project
+from character_store import CharacterStore
+from kobold_client import KoboldClient, KoboldHealthMonitor
+from tts_pipeline import speech_pipelines, speech_voice, speech_segments, ACTION_TEXT
 import base64
 import lzma
 import json
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
 
 # Load environment variables
 load_dotenv('/root/.env')
@@ -56,6 +66,16 @@ model_cache._base_model_path = "/root/models"
 model_cache._input_dir = "/root/input/"
 model_cache._output_dir = "/root/output/"
 model_cache._cache_timeout = 1800  # 30 minutes timeout
+model_cache._max_models = int(os.getenv('RVC_CACHE_MAX_MODELS', '6'))
+model_cache._max_bytes = int(os.getenv('RVC_CACHE_MAX_MB', '4096')) * 1024 * 1024
+model_cache._max_instances_per_model = int(os.getenv('RVC_MAX_INSTANCES_PER_MODEL', '2'))
+model_cache._popularity_file = os.path.join(model_cache._base_model_path, "popularity.json")
+RVC_PRELOAD_TOP_K = int(os.getenv('RVC_PRELOAD_TOP_K', '3'))  # Most requested models loaded at startup
+
+audio_cache._directory = "/root/output/"
+audio_cache._max_bytes = int(os.getenv('TTS_AUDIO_CACHE_MAX_MB', '1024')) * 1024 * 1024
+# Encoding served for /audio/*.wav when the client doesn't ask for one: opus, mp3 or wav
+AUDIO_OUTPUT_FORMAT = os.getenv('AUDIO_OUTPUT_FORMAT', 'mp3')
 
 # App Configuration
 app.config.update(
@@ -69,7 +89,11 @@ app.config.update(
     PERMANENT_SESSION_LIFETIME=timedelta(days=31),
     SESSION_COOKIE_PATH='/',
     MAX_CONTENT_LENGTH=1024 * 1024 * 1024,
+    # Hand file bodies to a fronting web server instead of copying them through Python
+    USE_X_SENDFILE=os.getenv('USE_X_SENDFILE', '0') == '1',
 )
+# nginx spells X-Sendfile as X-Accel-Redirect to an internal location, e.g. /protected/
+X_ACCEL_REDIRECT_PREFIX = os.getenv('X_ACCEL_REDIRECT_PREFIX')
     
 # Stripe Configuration
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
@@ -102,7 +126,38 @@ UPLOAD_FOLDER = '/root/main/avatars'
 CHARACTER_FOLDER = '/root/main/characters'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'mp4', 'webm', 'wmv'}
 KOBOLD_API = os.getenv('KOBOLD_API', 'http://127.0.0.1:5000')
-
+KOBOLD_POOL_SIZE = int(os.getenv('KOBOLD_POOL_SIZE', '10'))
+KOBOLD_HEALTH_INTERVAL = float(os.getenv('KOBOLD_HEALTH_INTERVAL', '5'))  # Seconds between health probes
+# Generated audio is deleted once unserved for this long, or least recently
+# served first when the output directory grows past the byte budget
+AUDIO_RETENTION_MAX_AGE_HOURS = float(os.getenv('AUDIO_RETENTION_MAX_AGE_HOURS', '168'))
+AUDIO_RETENTION_MAX_MB = int(os.getenv('AUDIO_RETENTION_MAX_MB', '2048'))
+AUDIO_RETENTION_SWEEP_INTERVAL = 300
+CHARACTER_CATALOG_POLL_INTERVAL = float(os.getenv('CHARACTER_CATALOG_POLL_INTERVAL', '2'))  # Seconds between checks for characters changed by other workers
+CHARACTER_PAGE_SIZE = int(os.getenv('CHARACTER_PAGE_SIZE', '24'))  # Default ?limit= for paginated listings
+CHARACTER_PAGE_SIZE_MAX = int(os.getenv('CHARACTER_PAGE_SIZE_MAX', '100'))
+CHARACTER_POPULARITY_REFRESH = int(os.getenv('CHARACTER_POPULARITY_REFRESH', '300'))  # Seconds a popularity ranking is paged from before it is rebuilt
+QUEUE_WAIT_TIMEOUT = 30  # Seconds a route blocks waiting on a queued request
+QUEUE_HEARTBEAT_INTERVAL = 5  # Seconds between position updates on status streams
+GREETING_RENDER_USER = 'greeting-render'  # Queue user id for background greeting synthesis
+GREETING_RENDER_TIMEOUT = 300
+# Chat micro-batching: 0 disables it; otherwise requests arriving within the
+# window with matching sampling params are dispatched to Kobold together
+KOBOLD_BATCH_WINDOW_MS = float(os.getenv('KOBOLD_BATCH_WINDOW_MS', '0'))
+KOBOLD_BATCH_SIZE = int(os.getenv('KOBOLD_BATCH_SIZE', '4'))
+KOBOLD_SLOTS = int(os.getenv('KOBOLD_SLOTS', '8'))  # Conversations the backend generates in parallel (KoboldCPP --multiuser)
+
+
+kobold_client = KoboldClient(KOBOLD_API, pool_size=KOBOLD_POOL_SIZE)
+kobold_health = KoboldHealthMonitor(kobold_client, interval=KOBOLD_HEALTH_INTERVAL)
+audio_retention = AudioRetention(
+    OUTPUT_DIRECTORY,
+    max_age=AUDIO_RETENTION_MAX_AGE_HOURS * 3600,
+    max_bytes=AUDIO_RETENTION_MAX_MB * 1024 * 1024,
+    interval=AUDIO_RETENTION_SWEEP_INTERVAL,
+    on_remove=audio_cache.forget
+)
+audio_cache.on_remove = audio_retention.forget
 
 os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -237,7 +292,7 @@ class CreditTransaction(db.Model):
 
 class Character(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    creator_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
+    creator_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=False)
     system_prompt = db.Column(db.Text, nullable=False)
@@ -249,9 +304,65 @@ class Character(db.Model):
     is_approved = db.Column(db.Boolean, default=False)
     approval_status = db.Column(db.String(20), default='pending')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow, index=True)
     settings = db.Column(db.JSON)
     greetings = db.Column(db.JSON) 
+    data = db.Column(db.JSON)  # The full character document; the columns above are copies of its fields
+    version = db.Column(db.Integer, nullable=False, default=0, index=True)  # Table-wide write counter; see CharacterStore
+
+    SETTINGS_FIELDS = ('tts_rate', 'rvc_pitch', 'ai_parameters', 'tags', 'rvc_model')
+
+    def apply(self, char_data):
+        """Store a character document, copying the fields queries use into their columns"""
+        self.data = char_data
+        self.creator_id = str(char_data.get('creator') or '')
+        self.name = char_data.get('name') or ''
+        self.description = char_data.get('description') or ''
+        self.system_prompt = char_data.get('systemPrompt') or ''
+        self.greetings = char_data.get('greetings') or []
+        self.avatar_path = char_data.get('avatar') or ''
+        self.background_path = char_data.get('background')
+        self.tts_voice = char_data.get('ttsVoice') or ''
+        self.category = char_data.get('category')
+        self.is_private = bool(char_data.get('isPrivate', False))
+        self.is_approved = bool(char_data.get('isApproved', False))
+        self.approval_status = char_data.get('approvalStatus') or ('approved' if self.is_approved else 'pending')
+        self.settings = Character.settings_of(char_data)
+        self.updated_at = datetime.utcnow()
+
+    @staticmethod
+    def settings_of(char_data):
+        return {field: char_data[field] for field in Character.SETTINGS_FIELDS if field in char_data}
+
+    @staticmethod
+    def document_of(row):
+        """Character document for an ORM or Core row; rows written before the
+        data column existed are rebuilt from their columns"""
+        if row.data is not None:
+            return dict(row.data)
+        settings = row.settings or {}
+        char_data = {
+            'id': row.id,
+            'name': row.name,
+            'description': row.description,
+            'systemPrompt': row.system_prompt,
+            'greetings': row.greetings or [],
+            'avatar': row.avatar_path,
+            'ttsVoice': row.tts_voice,
+            'category': row.category,
+            'tags': settings.get('tags', []),
+            'tts_rate': settings.get('tts_rate', 0),
+            'rvc_pitch': settings.get('rvc_pitch', 0),
+            'dateAdded': row.created_at.isoformat() if row.created_at else None,
+            'creator': row.creator_id,
+            'isPrivate': bool(row.is_private),
+            'isApproved': bool(row.is_approved),
+            'approvalStatus': row.approval_status
+        }
+        for field, value in (('background', row.background_path), ('ai_parameters', settings.get('ai_parameters')), ('rvc_model', settings.get('rvc_model'))):
+            if value:
+                char_data[field] = value
+        return char_data
 
     def to_dict(self):
         return {
@@ -267,6 +378,11 @@ class Character(db.Model):
             'settings': self.settings
         }
 
+# The character table is authoritative; every read is served from the store's in-memory catalog
+character_store = CharacterStore(db, Character)
+character_catalog = character_store.catalog
+character_catalog.popularity_interval = CHARACTER_POPULARITY_REFRESH
+
 class CharacterApprovalQueue(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     character_id = db.Column(db.String(36), db.ForeignKey('character.id'), nullable=False)
@@ -297,21 +413,72 @@ def kobold_handler(data):
     """Handle Kobold API requests"""
     try:
         # Your existing Kobold API call
-        kobold_response = requests.post(
-            'http://127.0.0.1:5000/v1/chat/completions', 
-            json=data
-        )
+        kobold_response = kobold_client.post('/v1/chat/completions', json=data)
         return kobold_response.json()
     except Exception as e:
         raise Exception(f"Kobold API error: {str(e)}")
 
-def check_kobold_available():
-    """Check if KoboldCPP API is available"""
+def chunk_content(chunk):
+    """Text delta carried by one streamed completion chunk, or '' if none"""
     try:
-        response = requests.get(f'{KOBOLD_API}/api/v1/model')
-        return response.ok
-    except:
-        return False
+        delta = json.loads(chunk)['choices'][0].get('delta') or {}
+        return delta.get('content') or ''
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ''
+
+def kobold_stream_handler(data, emit):
+    """Stream a Kobold chat completion, emitting each SSE data payload as it arrives"""
+    try:
+        kobold_response = kobold_client.post('/v1/chat/completions', json=data, stream=True)
+        content = []
+        try:
+            if not kobold_response.ok:
+                raise Exception(f"status {kobold_response.status_code}")
+            for line in kobold_response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                emit(payload)
+                content.append(chunk_content(payload))
+        finally:
+            kobold_response.close()
+
+        # Same shape as a non-streamed completion, for status lookups
+        return {
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(content)},
+                'finish_reason': 'stop'
+            }]
+        }
+    except Exception as e:
+        raise Exception(f"Kobold API error: {str(e)}")
+
+# Batched calls share this pool, one thread per backend slot, so batches can
+# keep more of Kobold busy than the queue's workers alone would
+kobold_batch_pool = ThreadPoolExecutor(
+    max_workers=KOBOLD_SLOTS,
+    thread_name_prefix='kobold-batch'
+)
+
+def kobold_batch_handler(batch):
+    """Send a batch of chat requests to Kobold concurrently, one future per request.
+
+    KoboldCPP's chat endpoint takes a single conversation, so the batch is
+    dispatched in parallel to fill the backend's concurrent slots instead
+    of reaching it strictly one request at a time.
+    """
+    return [kobold_batch_pool.submit(kobold_handler, data) for data in batch]
+
+def chat_batch_key(data):
+    """Requests may share a batch only if everything but the messages matches."""
+    return json.dumps({k: v for k, v in data.items() if k != 'messages'}, sort_keys=True, default=str)
+
+def check_kobold_available():
+    """Check if KoboldCPP API may be called (the background prober's breaker, with half-open trials)"""
+    return kobold_health.allow_request()
 
 def handle_kobold_error(response):
     """Handle error responses from KoboldCPP"""
@@ -338,6 +505,14 @@ def require_kobold(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def tts_audio_key(data):
+    """Audio cache digest for a TTS request's text and voice"""
+    return audio_cache.key(
+        data.get('text'), data.get('edge_voice'), data.get('rvc_model'),
+        data.get('rvc_pitch', 0), data.get('tts_rate', 0),
+        model_cache.model_version(data.get('rvc_model'))
+    )
+
 def tts_handler(data):
     try:
         print("TTS handler received data:", data)
@@ -347,34 +522,87 @@ def tts_handler(data):
         tts_rate = data.get("tts_rate", 0)
         rvc_pitch = data.get("rvc_pitch", 0)
 
-        # Get TTS instance from cache
-        tts = model_cache.get_model(character_id)
-        
+        # Identical lines rendered before are served from the audio cache
+        digest = tts_audio_key(data)
+        cached_filename = audio_cache.lookup(digest)
+        if cached_filename:
+            return {"audio_url": f"/audio/{cached_filename}", "cached": True}
+
         unique_id = str(uuid.uuid4())
         output_filename = f"response_{unique_id}.wav"
         output_path = os.path.join(OUTPUT_DIRECTORY, output_filename)
 
-        # Set voice and generate audio
-        if edge_voice:
-            tts.set_voice(edge_voice)
-            
-        tts(
-            text=text,
+        # Borrow a pooled instance so concurrent requests don't share voice state
+        model_cache.synthesize(
+            character_id,
+            text,
+            output_path,
+            edge_voice=edge_voice,
             pitch=rvc_pitch,
-            tts_rate=tts_rate,
-            output_filename=output_path
+            tts_rate=tts_rate
         )
 
         if not os.path.exists(output_path):
             raise Exception("Failed to generate audio file")
 
-        return {"audio_url": f"/audio/{output_filename}"}
+        output_filename = audio_cache.store(digest, output_path)
+        audio_retention.touch(output_filename)
+        return {"audio_url": f"/audio/{output_filename}", "cached": False}
 
     except Exception as e:
         print(f"TTS handler error: {str(e)}")
+        import traceback
         traceback.print_exc()
         raise Exception(f"TTS error: {str(e)}")
 
+greeting_render_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='greeting-render')
+
+def greeting_voice(character_id, char_data):
+    """TTS parameters a chat page uses for this character's lines"""
+    return {
+        'edge_voice': char_data.get('ttsVoice'),
+        'rvc_model': char_data.get('existingCharacterModel') or char_data.get('rvc_model') or character_id,
+        'tts_rate': char_data.get('tts_rate', 0),
+        'rvc_pitch': char_data.get('rvc_pitch', 0)
+    }
+
+def schedule_greeting_render(character_id):
+    greeting_render_pool.submit(render_greeting_audio, character_id)
+
+def render_greeting_audio(character_id):
+    """Render every greeting through the character's voice and record the audio URLs"""
+    try:
+        char_data = character_store.get(character_id)
+        if char_data is None:
+            return
+        voice = greeting_voice(character_id, char_data)
+
+        greeting_audio = {}
+        for greeting in char_data.get('greetings') or []:
+            # Same filtering as the chat page's filterTextForTTS
+            text = ACTION_TEXT.sub('', greeting).strip()
+            if not text:
+                continue
+            request_id = request_queue.add_request(GREETING_RENDER_USER, 'tts', dict(voice, text=text))
+            status = request_queue.wait_for(request_id, timeout=GREETING_RENDER_TIMEOUT)
+            if status['status'] == 'complete':
+                greeting_audio[greeting] = status['result']['audio_url']
+            else:
+                print(f"Greeting render for {character_id} did not complete: {status['status']}")
+
+        # Re-read so edits made while rendering aren't lost; skip if the voice changed
+        char_data = character_store.get(character_id)
+        if char_data is None or greeting_voice(character_id, char_data) != voice:
+            return
+        greetings = char_data.get('greetings') or []
+        char_data['greetingAudio'] = {greeting: url for greeting, url in greeting_audio.items() if greeting in greetings}
+        with app.app_context():
+            character_store.save(character_id, char_data)
+        print(f"Pre-rendered {len(greeting_audio)} greetings for character {character_id}")
+
+    except Exception as e:
+        print(f"Error pre-rendering greetings for {character_id}: {str(e)}")
+
 def prepare_story_context(character, messages, scenario, other_characters):
     base_context = {
         'role': 'system',
@@ -693,12 +921,10 @@ def story_completions():
             print("\nLoading character data...")
             valid_characters = []
             for story_char in story_chars:
-                char_file_path = os.path.join(CHARACTER_FOLDER, f"{story_char.character_id}.json")
-                if os.path.exists(char_file_path):
-                    with open(char_file_path, 'r', encoding='utf-8') as f:
-                        char_data = json.load(f)
-                        valid_characters.append((char_data, story_char))
-                        print(f"Loaded character: {char_data['name']}")
+                char_data = character_store.get(story_char.character_id)
+                if char_data is not None:
+                    valid_characters.append((char_data, story_char))
+                    print(f"Loaded character: {char_data['name']}")
 
             if not valid_characters:
                 raise ValueError("No valid characters found")
@@ -867,7 +1093,13 @@ def tts():
 
     try:
         CREDITS_PER_TTS = 5
-        
+        data = request.json
+
+        # Cache hits skip the queue entirely and are free, since nothing is synthesized
+        cached_filename = audio_cache.lookup(tts_audio_key(data))
+        if cached_filename:
+            return jsonify({'audio_url': f"/audio/{cached_filename}", 'cached': True})
+
         # Check if user has enough credits
         if not current_user.deduct_credits_atomic(CREDITS_PER_TTS):
             return jsonify({
@@ -886,7 +1118,6 @@ def tts():
         db.session.add(transaction)
 
         # Add request to queue
-        data = request.json
         request_id = request_queue.add_request(current_user.id, 'tts', data)
         
         # Check initial status
@@ -899,19 +1130,16 @@ def tts():
                 'request_id': request_id
             })
         
-        # Poll for completion if position is low
-        max_attempts = 30
-        for _ in range(max_attempts):
-            status = request_queue.get_status(request_id)
-            if status['status'] == 'complete':
-                db.session.commit()
-                return jsonify(status['result'])
-            elif status['status'] == 'error':
-                current_user.add_credits(CREDITS_PER_TTS)
-                db.session.delete(transaction)
-                db.session.commit()
-                return jsonify({'error': status['result']['error']}), 500
-            time.sleep(1)
+        # Wait for completion if position is low
+        status = request_queue.wait_for(request_id, timeout=QUEUE_WAIT_TIMEOUT)
+        if status['status'] == 'complete':
+            db.session.commit()
+            return jsonify(status['result'])
+        elif status['status'] == 'error':
+            current_user.add_credits(CREDITS_PER_TTS)
+            db.session.delete(transaction)
+            db.session.commit()
+            return jsonify({'error': status['result']['error']}), 500
         
         # Timeout - refund credits
         current_user.add_credits(CREDITS_PER_TTS)
@@ -926,14 +1154,248 @@ def tts():
             db.session.commit()
         return jsonify({'error': str(e)}), 500
 
+def stream_tts_segments(speech, writer):
+    """Write each sentence's audio to the response as soon as it is synthesized.
+
+    Replaying a stream never charges again; segments are replayed from the
+    results the pipeline kept. Its prepaid credits are refunded only when
+    the first sentence failed with an error, i.e. nothing was synthesized.
+    """
+    error = None
+    try:
+        for index, status in speech.iter_segments(timeout=QUEUE_WAIT_TIMEOUT):
+            if status is None:
+                error = 'Request timeout'
+                break
+            if status['status'] != 'complete':
+                error = status['result']['error']
+                if index == 0:
+                    refund_tts_stream(speech)
+                break
+            speech.take_charge()  # Audio exists now; the charge stands
+            wav_filename = os.path.basename(status['result']['audio_url'])
+            audio_retention.touch(wav_filename)
+            for block in writer.segment(os.path.join(OUTPUT_DIRECTORY, wav_filename)):
+                yield block
+    except Exception as e:
+        error = str(e)
+    if error:
+        print(f"TTS stream stopped early: {error}")
+
+def refund_tts_stream(speech):
+    charge = speech.take_charge()
+    if charge is None:
+        return
+    transaction_id, credits = charge
+    user = db.session.get(User, speech.user_id)
+    transaction = db.session.get(CreditTransaction, transaction_id)
+    if transaction is not None:
+        db.session.delete(transaction)
+    if user is not None:
+        user.add_credits(credits)
+    db.session.commit()
+
+def encode_stream_segment(wav_path):
+    mp3_path = encoded_path(wav_path, 'mp3')
+    audio_retention.touch(os.path.basename(mp3_path))
+    return mp3_path
+
+@app.route('/v1/tts/stream', methods=['POST'])
+@login_required
+def start_tts_stream():
+    """Charge for a streamed synthesis and start it sentence by sentence.
+
+    Returns a stream_url to play the audio from; fetching it, even
+    repeatedly, doesn't charge again. Like /v1/tts, text whose every
+    sentence is already in the audio cache is free.
+    """
+    data = request.json or {}
+    text = data.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return jsonify({'error': 'text is required'}), 400
+    try:
+        voice = speech_voice(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    segments = speech_segments(text)
+    if not segments:
+        return jsonify({'error': 'No speakable text'}), 400
+
+    # Nothing to synthesize if every sentence is cached, so nothing to charge
+    charge = None
+    if not all(audio_cache.lookup(tts_audio_key(dict(voice, text=segment))) for segment in segments):
+        CREDITS_PER_TTS = 5
+        if not current_user.deduct_credits_atomic(CREDITS_PER_TTS):
+            return jsonify({
+                'error': 'Insufficient credits',
+                'credits_required': CREDITS_PER_TTS,
+                'credits_available': current_user.credits
+            }), 402
+
+        transaction = CreditTransaction(
+            user_id=current_user.id,
+            amount=-CREDITS_PER_TTS,
+            transaction_type='tts',
+            description='Text-to-speech conversion (streamed)'
+        )
+        db.session.add(transaction)
+        db.session.commit()
+        charge = (transaction.id, CREDITS_PER_TTS)
+
+    speech = speech_pipelines.create(request_queue, current_user.id, voice)
+    speech.charge = charge
+    speech.feed(text)
+    speech.finish()
+    return jsonify({'stream_id': speech.id, 'stream_url': f"/v1/tts/stream/{speech.id}"})
+
+@app.route('/v1/tts/stream/<stream_id>')
+@login_required
+def tts_stream(stream_id):
+    """One chunked audio response for a prepaid stream, usable directly as an
+    <audio> source; playback starts with the first sentence"""
+    speech = speech_pipelines.get(stream_id)
+    if not speech or speech.user_id != current_user.id:
+        return jsonify({'error': 'Stream not found'}), 404
+
+    # Segments are joined by concatenation, so only MP3 or raw WAV samples work
+    encoding = negotiate(request.headers.get('Accept'), request.args.get('format'), 'mp3')
+    if encoding != 'wav' and transcoder_available():
+        writer = EncodedStreamWriter(ENCODINGS['mp3'][0], encode_stream_segment)
+    else:
+        writer = WavStreamWriter()
+
+    return Response(
+        stream_with_context(stream_tts_segments(speech, writer)),
+        mimetype=writer.mimetype,
+        headers={
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/v1/tts/warm', methods=['POST'])
+@login_required
+def warm_tts_model():
+    # Called when a chat page opens so the first spoken reply skips the cold load
+    data = request.json or {}
+    character_id = data.get('character_id')
+    if not character_id:
+        return jsonify({'error': 'character_id is required'}), 400
+    char_data = character_store.get(str(character_id))
+    if char_data is None:
+        return jsonify({'error': 'Character not found'}), 404
+    is_public = not char_data.get('isPrivate') and char_data.get('isApproved', False)
+    if not is_public and str(char_data.get('creator')) != str(current_user.id) and not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    rvc_model = greeting_voice(char_data['id'], char_data)['rvc_model']
+    if not model_cache.has_model(rvc_model):
+        return jsonify({'warming': False})
+    return jsonify({'warming': model_cache.warm(rvc_model)})
+
 @app.route('/v1/chat/status/<request_id>')
 @login_required
 def check_chat_status(request_id):
-    status = request_queue.get_status(request_id)
+    # Optional long-poll: ?wait=<seconds> holds the request until it finishes
+    wait = min(request.args.get('wait', 0, type=float), QUEUE_WAIT_TIMEOUT)
+    if wait > 0:
+        status = request_queue.wait_for(request_id, timeout=wait)
+    else:
+        status = request_queue.get_status(request_id)
     if not status:
         return jsonify({'error': 'Request not found'}), 404
     return jsonify(status)
 
+@app.route('/v1/chat/status/<request_id>/stream')
+@login_required
+def stream_chat_status(request_id):
+    if not request_queue.get_status(request_id):
+        return jsonify({'error': 'Request not found'}), 404
+
+    def generate():
+        # Push a status event whenever the request finishes, with a periodic
+        # heartbeat carrying the current queue position until then
+        while True:
+            status = request_queue.wait_for(request_id, timeout=QUEUE_HEARTBEAT_INTERVAL)
+            if not status:
+                yield f"event: error\ndata: {json.dumps({'error': 'Request not found'})}\n\n"
+                return
+            yield f"data: {json.dumps(status)}\n\n"
+            if status['status'] in ('complete', 'error'):
+                return
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def stream_chat_completion(request_id, transaction, credits, voice=None):
+    """Relay a streaming chat request as SSE, settling credits when it ends.
+
+    With a voice, the reply is also fed to a speech pipeline sentence by
+    sentence and the client is told where to subscribe for the audio
+    segments. The pipeline is registered only once the stream starts, so
+    a response that is never read leaves nothing behind.
+    """
+    settled = False
+    speech = None
+    try:
+        error = None
+        if voice:
+            speech = speech_pipelines.create(request_queue, current_user.id, voice)
+            yield f"event: speech\ndata: {json.dumps({'pipeline_id': speech.id})}\n\n"
+        try:
+            for chunk in request_queue.stream(request_id, timeout=QUEUE_WAIT_TIMEOUT):
+                if speech:
+                    speech.feed(chunk_content(chunk))
+                yield f"data: {chunk}\n\n"
+            status = request_queue.get_status(request_id)
+            if status and status['status'] == 'complete':
+                db.session.commit()  # Commit the transaction
+                settled = True
+                yield "data: [DONE]\n\n"
+                return
+            error = status['result']['error'] if status else 'Request expired'
+        except Empty:
+            error = 'Request timeout'
+
+        # Refund credits on error or timeout
+        current_user.add_credits(credits)
+        db.session.delete(transaction)
+        db.session.commit()
+        settled = True
+        yield f"event: error\ndata: {json.dumps({'error': error})}\n\n"
+    finally:
+        if speech:
+            speech.finish()
+        if not settled:
+            # Client went away mid-stream; the generation still ran, so charge it
+            db.session.commit()
+
+@app.route('/v1/tts/pipeline/<pipeline_id>/events')
+@login_required
+def stream_speech_segments(pipeline_id):
+    speech = speech_pipelines.get(pipeline_id)
+    if not speech or speech.user_id != current_user.id:
+        return jsonify({'error': 'Pipeline not found'}), 404
+
+    def generate():
+        # Audio segment URLs in reply order, each as soon as it is synthesized
+        for index, status in speech.iter_segments(timeout=QUEUE_WAIT_TIMEOUT):
+            segment = {'index': index}
+            if status and status['status'] == 'complete':
+                segment.update(status['result'])
+            else:
+                segment['error'] = status['result']['error'] if status and status.get('result') else 'Segment timeout'
+            yield f"data: {json.dumps(segment)}\n\n"
+        yield "event: end\ndata: {}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/v1/chat/completions', methods=['POST'])
 @login_required
 def chat_completions():
@@ -941,7 +1403,18 @@ def chat_completions():
         return handle_options()
 
     try:
+        data = request.json
         CREDITS_PER_MESSAGE = 10
+        CREDITS_PER_TTS = 5
+
+        # A streamed reply can be spoken as it generates; charge for both up front
+        voice = data.pop('tts', None) if data.get('stream') else None
+        if voice:
+            try:
+                voice = speech_voice(voice)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            CREDITS_PER_MESSAGE += CREDITS_PER_TTS
         
         # Check if user has enough credits
         if not current_user.deduct_credits_atomic(CREDITS_PER_MESSAGE):
@@ -956,12 +1429,20 @@ def chat_completions():
             user_id=current_user.id,
             amount=-CREDITS_PER_MESSAGE,
             transaction_type='message',
-            description='Chat completion message'
+            description='Chat completion message with speech' if voice else 'Chat completion message'
         )
         db.session.add(transaction)
 
         # Add request to queue
-        data = request.json
+        if data.get('stream'):
+            request_id = request_queue.add_request(current_user.id, 'chat', data, stream=True)
+            return Response(stream_with_context(stream_chat_completion(
+                request_id, transaction, CREDITS_PER_MESSAGE, voice
+            )), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+
         request_id = request_queue.add_request(current_user.id, 'chat', data)
         
         # Check initial status
@@ -975,20 +1456,17 @@ def chat_completions():
                 'request_id': request_id
             })
         
-        # Poll for completion if position is low
-        max_attempts = 30  # 30 second timeout
-        for _ in range(max_attempts):
-            status = request_queue.get_status(request_id)
-            if status['status'] == 'complete':
-                db.session.commit()  # Commit the transaction
-                return jsonify(status['result'])
-            elif status['status'] == 'error':
-                # Refund credits on error
-                current_user.add_credits(CREDITS_PER_MESSAGE)
-                db.session.delete(transaction)
-                db.session.commit()
-                return jsonify({'error': status['result']['error']}), 500
-            time.sleep(1)
+        # Wait for completion if position is low
+        status = request_queue.wait_for(request_id, timeout=QUEUE_WAIT_TIMEOUT)
+        if status['status'] == 'complete':
+            db.session.commit()  # Commit the transaction
+            return jsonify(status['result'])
+        elif status['status'] == 'error':
+            # Refund credits on error
+            current_user.add_credits(CREDITS_PER_MESSAGE)
+            db.session.delete(transaction)
+            db.session.commit()
+            return jsonify({'error': status['result']['error']}), 500
         
         # Timeout - refund credits
         current_user.add_credits(CREDITS_PER_MESSAGE)
@@ -1034,6 +1512,9 @@ def create_character():
             
         if not data.get('avatar'):
             return jsonify({'error': 'Avatar is required'}), 400
+
+        if character_store.get(char_id) is not None:
+            return jsonify({'error': 'Character already exists'}), 409
             
         # Handle greeting/greetings conversion
         greetings = []
@@ -1053,42 +1534,8 @@ def create_character():
         if data.get('ai_parameters'):
             ai_parameters.update(data['ai_parameters'])
 
-        # Prepare settings
-        settings = {
-            'tts_rate': data.get('tts_rate', 0),
-            'rvc_pitch': data.get('rvc_pitch', 0),
-            'ai_parameters': ai_parameters,
-            'tags': data.get('tags', [])
-        }
-            
-        character = Character(
-            id=char_id,
-            creator_id=current_user.id,
-            name=data['name'],
-            description=data.get('description', ''),
-            system_prompt=data.get('systemPrompt', ''),
-            greetings=greetings,
-            avatar_path=data['avatar'],
-            background_path=data.get('background'),
-            tts_voice=data.get('ttsVoice', ''),
-            category=data.get('category', 'Other'),
-            is_private=is_private,
-            is_approved=is_private,
-            approval_status='approved' if is_private else 'pending',
-            settings=settings
-        )
-        
-        try:
-            db.session.add(character)
-            db.session.flush()
-            print("Character added to database")
-        except Exception as db_error:
-            print("Database error:", str(db_error))
-            raise
-            
         try:
-            # Create character JSON file
-            char_file_data = {
+            char_data = {
                 'id': char_id,
                 'name': data['name'],
                 'avatar': data['avatar'],
@@ -1109,19 +1556,13 @@ def create_character():
             }
             
             if data.get('background'):
-                char_file_data['background'] = data['background']
+                char_data['background'] = data['background']
 
             if data.get('rvc_model'):
-                char_file_data['rvc_model'] = data['rvc_model']
-            
-            # Save character JSON file
-            char_file_path = os.path.join(CHARACTER_FOLDER, f"{char_id}.json")
-            with open(char_file_path, 'w', encoding='utf-8') as f:
-                json.dump(char_file_data, f, indent=2)
-            print("Character JSON file created")
+                char_data['rvc_model'] = data['rvc_model']
             
-            db.session.commit()
-            print("Database committed")
+            character_store.save(char_id, char_data)
+            print("Character saved")
             
             # Award credits
             current_user.add_credits(200)
@@ -1134,6 +1575,8 @@ def create_character():
             db.session.add(transaction)
             db.session.commit()
             print("Credits awarded")
+
+            schedule_greeting_render(char_id)
             
             return jsonify({
                 'message': 'Character created successfully',
@@ -1143,7 +1586,7 @@ def create_character():
             }), 201
             
         except Exception as e:
-            print("Error saving character file:", str(e))
+            print("Error saving character:", str(e))
             raise
             
     except Exception as e:
@@ -1156,24 +1599,74 @@ def create_character():
 
 
 
+def character_popularity(char_data):
+    """TTS requests for the character's voice model, the closest signal to how often it's chatted with"""
+    return model_cache.request_count(greeting_voice(char_data['id'], char_data)['rvc_model'])
+
+def character_page_options():
+    """Parse ?limit=&cursor=&sort=&category=&tags= for a paginated listing, or None for the full list"""
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        return None
+    limit = request.args.get('limit', CHARACTER_PAGE_SIZE, type=int)
+    sort = request.args.get('sort', 'dateAdded')
+    if sort not in ('dateAdded', 'popularity'):
+        raise ValueError(f"Unknown sort: {sort}")
+    tags = [tag.strip() for tag in request.args.get('tags', '').split(',') if tag.strip()]
+    return {
+        'limit': max(1, min(limit, CHARACTER_PAGE_SIZE_MAX)),
+        'cursor': request.args.get('cursor'),
+        'sort': sort,
+        'category': request.args.get('category'),
+        'tags': tags,
+        'popularity': character_popularity
+    }
+
+def character_fields():
+    """Fields requested with ?fields=card or ?fields=a,b,c; None for everything"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    if fields == 'card':
+        return CARD_FIELDS
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+def character_listing(characters, fields):
+    return [project(char, fields) for char in characters] if fields else characters
+
 # Get public characters
 @app.route('/characters/public')
 def get_public_characters():
     try:
-        public_characters = []
-        if os.path.exists(CHARACTER_FOLDER):
-            for filename in os.listdir(CHARACTER_FOLDER):
-                if filename.endswith('.json'):
-                    try:
-                        with open(os.path.join(CHARACTER_FOLDER, filename), 'r', encoding='utf-8') as f:
-                            char_data = json.load(f)
-                            if not char_data.get('isPrivate', False) and char_data.get('isApproved', False):
-                                public_characters.append(char_data)
-                    except Exception as e:
-                        print(f"Error reading character file {filename}: {str(e)}")
-                        continue
-        return jsonify(public_characters)
+        try:
+            options = character_page_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        fields = character_fields()
+        if options is None:
+            return jsonify(character_listing(character_catalog.public(), fields))
+
+        try:
+            characters, next_cursor = character_catalog.public_page(**options)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'characters': character_listing(characters, fields), 'next_cursor': next_cursor})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/characters/search')
+def search_characters():
+    """Ranked full-text search over the characters the user can see"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'q is required'}), 400
+        limit = max(1, min(request.args.get('limit', CHARACTER_PAGE_SIZE, type=int), CHARACTER_PAGE_SIZE_MAX))
+        creator_id = current_user.id if current_user.is_authenticated else None
+        characters, total = character_catalog.search(query, creator_id=creator_id, limit=limit)
+        fields = character_fields()
+        return jsonify({'characters': character_listing(characters, fields), 'total': total})
     except Exception as e:
+        print(f"Error searching characters: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # Get private characters for current user
@@ -1181,17 +1674,10 @@ def get_public_characters():
 @login_required
 def get_private_characters():
     try:
-        characters = Character.query.filter_by(
-            creator_id=current_user.id,
-            is_private=True
-        ).all()
-        return jsonify([{
-            'id': char.id,
-            'name': char.name,
-            'description': char.description,
-            'avatar': char.avatar,
-            'category': char.category
-        } for char in characters])
+        return jsonify([
+            project(char, ('id', 'name', 'description', 'avatar', 'category'))
+            for char in character_catalog.private(current_user.id)
+        ])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1203,37 +1689,17 @@ def get_pending_characters():
         return jsonify({'error': 'Unauthorized'}), 403
         
     try:
-        pending_characters = []
-        if os.path.exists(CHARACTER_FOLDER):
-            for filename in os.listdir(CHARACTER_FOLDER):
-                if filename.endswith('.json'):
-                    try:
-                        with open(os.path.join(CHARACTER_FOLDER, filename), 'r', encoding='utf-8') as f:
-                            char_data = json.load(f)
-                            # Add debug logging
-                            print(f"Character data: {char_data}")
-                            
-                            if not char_data.get('isPrivate', False) and \
-                               not char_data.get('isApproved', False) and \
-                               char_data.get('approvalStatus') == 'pending':
-                                # Create character object with explicit background field
-                                char_obj = {
-                                    'id': char_data.get('id', filename.replace('.json', '')),
-                                    'name': char_data.get('name', 'Unknown'),
-                                    'description': char_data.get('description', ''),
-                                    'avatar': char_data.get('avatar', ''),
-                                    'background': char_data.get('background', ''),  # Make sure this matches the JSON field name
-                                    'category': char_data.get('category', 'Other'),
-                                    'creator_id': char_data.get('creator'),
-                                    'approvalStatus': char_data.get('approvalStatus', 'pending')
-                                }
-                                print(f"Adding pending character: {char_obj}")  # Debug log
-                                pending_characters.append(char_obj)
-                    except Exception as e:
-                        print(f"Error reading character file {filename}: {str(e)}")
-                        continue
-        
-        print(f"Total pending characters: {len(pending_characters)}")  # Debug log
+        pending_characters = [{
+            'id': char_data['id'],
+            'name': char_data.get('name', 'Unknown'),
+            'description': char_data.get('description', ''),
+            'avatar': char_data.get('avatar', ''),
+            'background': char_data.get('background', ''),  # Make sure this matches the JSON field name
+            'category': char_data.get('category', 'Other'),
+            'creator_id': char_data.get('creator'),
+            'approvalStatus': char_data.get('approvalStatus', 'pending')
+        } for char_data in character_catalog.pending()]
+
         return jsonify(pending_characters)
     except Exception as e:
         print(f"Error in get_pending_characters: {str(e)}")
@@ -1246,43 +1712,29 @@ def approve_character(character_id):
         return jsonify({'error': 'Unauthorized'}), 403
         
     try:
-        # Update JSON file first
-        char_file_path = os.path.join(CHARACTER_FOLDER, f"{character_id}.json")
-        if not os.path.exists(char_file_path):
+        char_data = character_store.get(character_id)
+        if char_data is None:
             return jsonify({'error': 'Character not found'}), 404
 
-        with open(char_file_path, 'r+', encoding='utf-8') as f:
-            char_data = json.load(f)
-            char_data['isApproved'] = True
-            char_data['approvalStatus'] = 'approved'
-            if 'rejectionReason' in char_data:
-                del char_data['rejectionReason']
-            
-            # Reset file pointer and write updated data
-            f.seek(0)
-            json.dump(char_data, f, indent=2)
-            f.truncate()
-
-        # Update database record if it exists
-        character = Character.query.get(character_id)
-        if character:
-            character.is_approved = True
-            character.approval_status = 'approved'
-            
-            # Award credits to creator
-            creator = User.query.get(character.creator_id)
-            if creator:
-                creator.add_credits(500)
-                transaction = CreditTransaction(
-                    user_id=creator.id,
-                    amount=500,
-                    transaction_type='character_approval',
-                    description=f'Character approved: {character.name}'
-                )
-                db.session.add(transaction)
-            
+        char_data['isApproved'] = True
+        char_data['approvalStatus'] = 'approved'
+        char_data.pop('rejectionReason', None)
+        character_store.save(character_id, char_data)
+
+        # Award credits to creator
+        creator = User.query.get(char_data.get('creator')) if char_data.get('creator') else None
+        if creator:
+            creator.add_credits(500)
+            transaction = CreditTransaction(
+                user_id=creator.id,
+                amount=500,
+                transaction_type='character_approval',
+                description=f'Character approved: {char_data.get("name")}'
+            )
+            db.session.add(transaction)
             db.session.commit()
 
+        schedule_greeting_render(character_id)
         return jsonify({'message': 'Character approved successfully'})
     except Exception as e:
         db.session.rollback()
@@ -1298,24 +1750,13 @@ def reject_character(character_id):
         data = request.json
         reason = data.get('reason', 'No reason provided')
         
-        # Update database
-        character = Character.query.get_or_404(character_id)
-        character.approval_status = 'rejected'
-        character.is_approved = False
-        
-        # Update JSON file
-        char_file_path = os.path.join(CHARACTER_FOLDER, f"{character_id}.json")
-        if os.path.exists(char_file_path):
-            with open(char_file_path, 'r+', encoding='utf-8') as f:
-                data = json.load(f)
-                data['approvalStatus'] = 'rejected'
-                data['isApproved'] = False
-                data['rejectionReason'] = reason
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-        
-        db.session.commit()
+        char_data = character_store.get(character_id)
+        if char_data is None:
+            return jsonify({'error': 'Character not found'}), 404
+        char_data['approvalStatus'] = 'rejected'
+        char_data['isApproved'] = False
+        char_data['rejectionReason'] = reason
+        character_store.save(character_id, char_data)
         return jsonify({'message': 'Character rejected', 'reason': reason})
     except Exception as e:
         db.session.rollback()
@@ -1434,10 +1875,7 @@ def check_character(character_name):
     # Check if character directory exists
     char_dir = os.path.join(CHARACTER_FOLDER, character_name)
     
-    # Check if character JSON exists
-    json_path = os.path.join(CHARACTER_FOLDER, f"{character_name}.json")
-    
-    exists = os.path.exists(avatar_path) or os.path.exists(char_dir) or os.path.exists(json_path)
+    exists = os.path.exists(avatar_path) or os.path.exists(char_dir) or character_store.get(character_name) is not None
     
     return jsonify({'exists': exists})
 
@@ -1461,6 +1899,8 @@ def upload_model():
                 
             model_path = os.path.join(model_dir, f"{char_id}.pth")
             model_file.save(model_path)
+            # Instances loaded from the old files would keep the old voice
+            model_cache._cleanup_model(char_id)
             return jsonify({'message': 'Model file uploaded successfully'})
             
         # Handle index file upload
@@ -1471,19 +1911,18 @@ def upload_model():
                 
             index_path = os.path.join(model_dir, f"{char_id}.index")
             index_file.save(index_path)
+            model_cache._cleanup_model(char_id)
             
             # Check if model file exists
             model_path = os.path.join(model_dir, f"{char_id}.pth")
             if not os.path.exists(model_path):
                 return jsonify({'error': 'Model file not found'}), 400
                 
-            # Update character settings
-            character = Character.query.get(char_id)
-            if character and character.creator_id == current_user.id:
-                if not character.settings:
-                    character.settings = {}
-                character.settings['rvc_model'] = char_id
-                db.session.commit()
+            # Point the character at its new model
+            char_data = character_store.get(char_id)
+            if char_data and str(char_data.get('creator')) == str(current_user.id):
+                char_data['rvc_model'] = char_id
+                character_store.save(char_id, char_data)
                 
             return jsonify({
                 'message': 'Model upload completed successfully',
@@ -1583,33 +2022,27 @@ def submit_for_review(character_id):
 @app.route('/characters/my-library')
 def my_library():
     try:
-        all_characters = []
-        for filename in os.listdir(CHARACTER_FOLDER):
-            if filename.endswith('.json') and filename != 'index.json':
-                file_path = os.path.join(CHARACTER_FOLDER, filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        char_data = json.load(f)
-                        
-                        # Add debug logging
-                        print(f"Loading character {filename}: Private: {char_data.get('isPrivate')}, Approved: {char_data.get('isApproved')}, Status: {char_data.get('approvalStatus')}")
-                        
-                        # For non-authenticated users
-                        if not current_user.is_authenticated:
-                            if not char_data.get('isPrivate') and char_data.get('isApproved'):
-                                all_characters.append(char_data)
-                            continue
-
-                        # For authenticated users
-                        # Show all their own characters
-                        if str(char_data.get('creator')) == str(current_user.id):
-                            all_characters.append(char_data)
-                        # Show public approved characters from others
-                        elif not char_data.get('isPrivate') and char_data.get('isApproved'):
-                            all_characters.append(char_data)
-                except Exception as e:
-                    print(f"Error reading character file {filename}: {str(e)}")
-                    continue
+        try:
+            options = character_page_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        fields = character_fields()
+        if options is not None:
+            section = request.args.get('section')
+            if section not in (None, 'private', 'public', 'pending'):
+                return jsonify({'error': f"Unknown section: {section}"}), 400
+            creator_id = current_user.id if current_user.is_authenticated else None
+            try:
+                characters, next_cursor = character_catalog.library_page(creator_id, section=section, **options)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return jsonify({'characters': character_listing(characters, fields), 'next_cursor': next_cursor})
+
+        if current_user.is_authenticated:
+            # Their own characters plus public approved characters from others
+            all_characters = character_catalog.library(current_user.id)
+        else:
+            all_characters = character_catalog.public()
 
         # Sort characters into appropriate categories
         response_data = {
@@ -1620,11 +2053,12 @@ def my_library():
 
         for char in all_characters:
             if char.get('isPrivate'):
-                response_data['private'].append(char)
+                section = 'private'
             elif char.get('approvalStatus') == 'pending':
-                response_data['pending'].append(char)
+                section = 'pending'
             else:
-                response_data['public'].append(char)
+                section = 'public'
+            response_data[section].append(project(char, fields) if fields else char)
 
         print(f"Returning characters: {len(response_data['public'])} public, {len(response_data['private'])} private, {len(response_data['pending'])} pending")
         
@@ -1636,16 +2070,46 @@ def my_library():
 
 @app.route('/audio/<filename>', methods=['GET'])
 def get_audio(filename):
-    file_path = os.path.join(OUTPUT_DIRECTORY, filename)
-    print(f"Requested audio file: {file_path}")
-    if os.path.exists(file_path):
+    stem, extension = os.path.splitext(filename)
+    wav_path = os.path.join(OUTPUT_DIRECTORY, f"{stem}.wav")
+    print(f"Requested audio file: {filename}")
+
+    # A .wav URL is negotiated against ?format= and Accept; other extensions are served as named
+    requested = encoding_for_extension(extension)
+    negotiated = extension == '.wav'
+    if negotiated:
+        requested = negotiate(request.headers.get('Accept'), request.args.get('format'), AUDIO_OUTPUT_FORMAT)
+        # Without ffmpeg every negotiated transcode would fail; serve the WAV
+        if requested != 'wav' and not transcoder_available():
+            requested = 'wav'
+    if not requested:
+        return jsonify({"error": "File not found"}), 404
+
+    try:
+        file_path = encoded_path(wav_path, requested)
+    except Exception as e:
+        print(f"Error transcoding {filename} to {requested}: {str(e)}")
+        file_path = wav_path if negotiated and os.path.exists(wav_path) else None
+        requested = 'wav'
+
+    if file_path and os.path.exists(file_path):
         print(f"Serving audio file: {file_path}")
-        response = send_file(file_path, mimetype="audio/wav")
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "0"
+        # conditional=True answers Range with 206 and If-None-Match/If-Modified-Since with 304
+        response = send_file(file_path, mimetype=ENCODINGS[requested][0], conditional=True, etag=True)
+        if stem.startswith('tts_'):
+            # Content-addressed: the name changes whenever the audio would
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            # Revalidate against the ETag/Last-Modified send_file sets; a match is a 304
+            response.headers["Cache-Control"] = "no-cache"
+        if negotiated:
+            response.headers["Vary"] = "Accept"
+        # The WAV is the cache's copy, so keep it alive alongside its transcodes
+        audio_retention.touch(os.path.basename(file_path))
+        if file_path != wav_path and os.path.exists(wav_path):
+            audio_retention.touch(os.path.basename(wav_path))
         return response
-    print(f"Audio file not found: {file_path}")
+    print(f"Audio file not found: {filename}")
     return jsonify({"error": "File not found"}), 404
 
 @app.route('/edit-character/<character_id>')
@@ -1653,26 +2117,20 @@ def get_audio(filename):
 def edit_character_page(character_id):
     try:
         print(f"Attempting to edit character: {character_id}")
-        # Load the character data from JSON
-        char_file_path = os.path.join(CHARACTER_FOLDER, f"{character_id}.json")
-        print(f"Looking for character file at: {char_file_path}")
-        
-        if not os.path.exists(char_file_path):
-            print(f"Character file not found: {char_file_path}")
+        char_data = character_store.get(character_id)
+        if char_data is None:
+            print(f"Character not found: {character_id}")
             return redirect(url_for('serve_index'))
-            
-        # Read the character data
-        with open(char_file_path, 'r', encoding='utf-8') as f:
-            char_data = json.load(f)
-            print(f"Character data loaded: {char_data}")
-            print(f"Current user ID: {current_user.id}")
-            print(f"Character creator: {char_data.get('creator')}")
-            print(f"Is admin: {current_user.is_admin}")
+
+        print(f"Character data loaded: {char_data}")
+        print(f"Current user ID: {current_user.id}")
+        print(f"Character creator: {char_data.get('creator')}")
+        print(f"Is admin: {current_user.is_admin}")
             
         # Check ownership or admin status
         if str(char_data.get('creator')) != str(current_user.id) and not current_user.is_admin:
             print(f"User {current_user.id} not authorized to edit character {character_id}")
-            print(f"Creator from file: {char_data.get('creator')}")
+            print(f"Creator: {char_data.get('creator')}")
             print(f"Current user: {current_user.id}")
             return redirect(url_for('serve_index'))
             
@@ -1690,38 +2148,22 @@ def edit_character_page(character_id):
 @login_required
 def get_character_data(character_id):
     try:
-        # Define the character JSON file path
-        char_file_path = os.path.join(CHARACTER_FOLDER, f"{character_id}.json")
-        
-        # Check if character JSON exists
-        if not os.path.exists(char_file_path):
+        char_data = character_store.get(character_id)
+        if char_data is None:
             return jsonify({'error': 'Character not found'}), 404
-            
-        # Load character data from JSON
-        try:
-            with open(char_file_path, 'r', encoding='utf-8') as f:
-                char_data = json.load(f)
-                
-            # Check ownership or admin status
-            if str(char_data.get('creator')) != str(current_user.id) and not current_user.is_admin:
-                return jsonify({'error': 'Unauthorized'}), 403
-
-            # Check database for additional data
-            character = Character.query.get(character_id)
-            if character:
-                # Merge database data if it exists
-                char_data.update({
-                    'approval_status': character.approval_status,
-                    'is_approved': character.is_approved,
-                    'settings': character.settings
-                })
 
-            return jsonify(char_data)
-            
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON for character {character_id}: {str(e)}")
-            return jsonify({'error': 'Invalid character data format'}), 500
-            
+        # Check ownership or admin status
+        if str(char_data.get('creator')) != str(current_user.id) and not current_user.is_admin:
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        # Same names the database columns used to be merged in under
+        char_data.update({
+            'approval_status': char_data.get('approvalStatus'),
+            'is_approved': char_data.get('isApproved', False),
+            'settings': Character.settings_of(char_data)
+        })
+        return jsonify(char_data)
+
     except Exception as e:
         print(f"Error getting character data: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -1767,17 +2209,23 @@ def favicon():
 @login_required
 def update_character(character_id):
     try:
-        # Load existing character data
-        char_file_path = os.path.join(CHARACTER_FOLDER, f"{character_id}.json")
-        with open(char_file_path, 'r', encoding='utf-8') as f:
-            existing_char_data = json.load(f)
+        existing_char_data = character_store.get(character_id)
+        if existing_char_data is None:
+            return jsonify({'error': 'Character not found'}), 404
             
         # Check ownership
         if str(existing_char_data.get('creator')) != str(current_user.id) and not current_user.is_admin:
             return jsonify({'error': 'Unauthorized'}), 403
             
-        # Get update data
+        # Get update data; approval and ownership only change through their own routes
         data = request.json
+        for field in ('isApproved', 'approvalStatus', 'creator', 'rejectionReason', 'greetingAudio'):
+            data.pop(field, None)
+        # Private characters skip review, so going public needs approval again
+        if 'isPrivate' in data and bool(data['isPrivate']) != bool(existing_char_data.get('isPrivate')):
+            data['isPrivate'] = bool(data['isPrivate'])
+            data['isApproved'] = data['isPrivate']
+            data['approvalStatus'] = 'approved' if data['isPrivate'] else 'pending'
         
         # Preserve avatar and background if not in update data
         if 'avatar' not in data or not data['avatar']:
@@ -1795,31 +2243,9 @@ def update_character(character_id):
         existing_char_data['creator'] = str(existing_char_data.get('creator'))
         existing_char_data['dateAdded'] = existing_char_data.get('dateAdded')
         
-        # Save updated data back to file
-        with open(char_file_path, 'w', encoding='utf-8') as f:
-            json.dump(existing_char_data, f, indent=2)
-            
-        # Update database record if it exists
-        character = Character.query.get(character_id)
-        if character:
-            if data.get('name'): character.name = data['name']
-            if data.get('description'): character.description = data['description']
-            if data.get('systemPrompt'): character.system_prompt = data['systemPrompt']
-            if data.get('greetings'): character.greetings = data['greetings']
-            if data.get('category'): character.category = data['category']
-            if data.get('ttsVoice'): character.tts_voice = data['ttsVoice']
-            if 'isPrivate' in data: character.is_private = data['isPrivate']
-            
-            # Update settings
-            if not character.settings:
-                character.settings = {}
-            if data.get('tts_rate') is not None: character.settings['tts_rate'] = data['tts_rate']
-            if data.get('rvc_pitch') is not None: character.settings['rvc_pitch'] = data['rvc_pitch']
-            if data.get('ai_parameters'): character.settings['ai_parameters'] = data['ai_parameters']
-            if data.get('rvc_model'): character.settings['rvc_model'] = data['rvc_model']
-            
-            db.session.commit()
-            
+        character_store.save(character_id, existing_char_data)
+
+        schedule_greeting_render(character_id)
         return jsonify({
             'message': 'Character updated successfully',
             'character_id': character_id
@@ -1837,26 +2263,13 @@ def clear_character_status(character_id):
         return jsonify({'error': 'Unauthorized'}), 403
         
     try:
-        # Update database
-        character = Character.query.get_or_404(character_id)
-        character.approval_status = 'pending'
-        character.is_approved = False
-        
-        # Update JSON file
-        char_file_path = os.path.join(CHARACTER_FOLDER, f"{character_id}.json")
-        if os.path.exists(char_file_path):
-            with open(char_file_path, 'r+', encoding='utf-8') as f:
-                data = json.load(f)
-                data['approvalStatus'] = 'pending'
-                data['isApproved'] = False
-                # Remove rejection reason if it exists
-                if 'rejectionReason' in data:
-                    del data['rejectionReason']
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-        
-        db.session.commit()
+        char_data = character_store.get(character_id)
+        if char_data is None:
+            return jsonify({'error': 'Character not found'}), 404
+        char_data['approvalStatus'] = 'pending'
+        char_data['isApproved'] = False
+        char_data.pop('rejectionReason', None)
+        character_store.save(character_id, char_data)
         return jsonify({'message': 'Character status cleared successfully'})
     except Exception as e:
         db.session.rollback()
@@ -1887,41 +2300,29 @@ def delete_character(character_id):
         
         # Define all paths that need to be checked and cleaned
         paths_to_clean = {
-            'json_file': os.path.join(BASE_PATH, 'characters', f'{character_id}.json'),
             'avatar': os.path.join(BASE_PATH, 'avatars', f'{character_id}-avatar.png'),
             'character_folder': os.path.join(BASE_PATH, 'characters', character_id),
             'model_folder': os.path.join(MODELS_PATH, character_id)
         }
 
         # First verify character exists and check ownership
-        character = None
-        if os.path.exists(paths_to_clean['json_file']):
-            try:
-                with open(paths_to_clean['json_file'], 'r', encoding='utf-8') as f:
-                    char_data = json.load(f)
-                    if str(char_data.get('creator')) != str(current_user.id) and not current_user.is_admin:
-                        return jsonify({'error': 'Unauthorized'}), 403
-            except json.JSONDecodeError as e:
-                return jsonify({'error': f'Invalid character file: {str(e)}'}), 400
-        else:
+        char_data = character_store.get(character_id)
+        if char_data is None:
             return jsonify({'error': 'Character not found'}), 404
-
-        # Check database record if it exists
-        character = Character.query.get(character_id)
-        if character and character.creator_id != current_user.id and not current_user.is_admin:
+        if str(char_data.get('creator')) != str(current_user.id) and not current_user.is_admin:
             return jsonify({'error': 'Unauthorized'}), 403
 
         # Delete files and folders
         cleanup_log = []
         cleanup_errors = []
 
-        # 1. Delete JSON file
-        if os.path.exists(paths_to_clean['json_file']):
-            try:
-                os.remove(paths_to_clean['json_file'])
-                cleanup_log.append(f"Deleted character file: {paths_to_clean['json_file']}")
-            except Exception as e:
-                cleanup_errors.append(f"Failed to delete character file: {str(e)}")
+        # 1. Delete the record first, so the character is gone even if file cleanup fails
+        try:
+            character_store.delete(character_id)
+            cleanup_log.append(f"Deleted database record for character: {character_id}")
+        except Exception as e:
+            db.session.rollback()
+            cleanup_errors.append(f"Failed to delete database record: {str(e)}")
 
         # 2. Delete avatar
         if os.path.exists(paths_to_clean['avatar']):
@@ -1947,16 +2348,6 @@ def delete_character(character_id):
             except Exception as e:
                 cleanup_errors.append(f"Failed to delete model folder: {str(e)}")
 
-        # 5. Delete database record if it exists
-        if character:
-            try:
-                db.session.delete(character)
-                db.session.commit()
-                cleanup_log.append(f"Deleted database record for character: {character_id}")
-            except Exception as e:
-                db.session.rollback()
-                cleanup_errors.append(f"Failed to delete database record: {str(e)}")
-
         # Log all operations
         print("Cleanup log:")
         for log in cleanup_log:
@@ -1979,8 +2370,7 @@ def delete_character(character_id):
         }), 200
 
     except Exception as e:
-        if 'character' in locals() and character:
-            db.session.rollback()
+        db.session.rollback()
         print(f"Error deleting character: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
@@ -2066,27 +2456,8 @@ def get_admin_stats():
             'total_transactions': 0
         }
         
-        # Make sure CHARACTER_FOLDER exists
-        if os.path.exists(CHARACTER_FOLDER):
-            for filename in os.listdir(CHARACTER_FOLDER):
-                if filename.endswith('.json'):
-                    try:
-                        stats['total_characters'] += 1
-                        with open(os.path.join(CHARACTER_FOLDER, filename), 'r', encoding='utf-8') as f:
-                            char_data = json.load(f)
-                            if char_data.get('isPrivate', False):
-                                stats['private_characters'] += 1
-                            elif char_data.get('isApproved', False):
-                                stats['approved_characters'] += 1
-                                stats['public_characters'] += 1
-                            elif char_data.get('approvalStatus') == 'pending':
-                                stats['pending_characters'] += 1
-                            elif char_data.get('approvalStatus') == 'rejected':
-                                stats['rejected_characters'] += 1
-                    except Exception as e:
-                        print(f"Error reading character file {filename}: {str(e)}")
-                        continue
-        
+        stats.update(character_catalog.counts())
+
         # Get user and transaction counts from database
         try:
             stats['total_users'] = User.query.count()
@@ -2108,6 +2479,27 @@ def get_admin_stats():
             'total_transactions': 0
         })
 
+@app.route('/api/admin/kobold-stats')
+@login_required
+def get_kobold_stats():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({
+        'client': kobold_client.get_stats(),
+        'health': kobold_health.get_status()
+    })
+
+@app.route('/api/admin/tts-stats')
+@login_required
+def get_tts_stats():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({
+        'models': model_cache.get_cache_stats(),
+        'audio_cache': audio_cache.get_stats(),
+        'audio_retention': audio_retention.get_stats()
+    })
+
 @app.after_request
 def after_request(response):
     # Allow the request origin
@@ -2121,6 +2513,15 @@ def after_request(response):
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'SAMEORIGIN'
     response.headers['X-XSS-Protection'] = '1; mode=block'
+
+    if X_ACCEL_REDIRECT_PREFIX and 'X-Sendfile' in response.headers:
+        sendfile_path = response.headers.pop('X-Sendfile')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX.rstrip('/') + sendfile_path
+        # nginx applies the client's Range to the file itself
+        if response.status_code == 206:
+            response.status_code = 200
+            response.headers.pop('Content-Range', None)
+            response.headers.pop('Content-Length', None)
     return response
 
 @app.route('/privacy-policy')
@@ -2207,26 +2608,38 @@ def get_story_sessions():
             creator_id=current_user.id,
             is_active=True
         ).all()
-        
+
+        def session_character(char):
+            char_data = (character_store.get(char.character_id) if char.character_id else None) or {}
+            return {
+                'id': char.character_id,
+                'name': char_data.get('name', PLACEHOLDER_NAME),
+                'avatar': char_data.get('avatar', PLACEHOLDER_IMAGE),
+                'position': char.position,
+                'is_placeholder': char.is_placeholder
+            }
+
         return jsonify([{
             'id': session.id,
             'title': session.title,
             'scenario': session.scenario,
-            'characters': [{
-                'id': char.character_id,
-                'name': Character.query.get(char.character_id).name if char.character_id 
-                        else PLACEHOLDER_NAME,
-                'avatar': (Character.query.get(char.character_id).avatar_path if char.character_id 
-                         else PLACEHOLDER_IMAGE),
-                'position': char.position,
-                'is_placeholder': char.is_placeholder
-            } for char in StoryCharacter.query.filter_by(session_id=session.id).order_by(StoryCharacter.position).all()]
+            'characters': [
+                session_character(char)
+                for char in StoryCharacter.query.filter_by(session_id=session.id).order_by(StoryCharacter.position).all()
+            ]
         } for session in sessions])
         
     except Exception as e:
         print(f"Error getting story sessions: {str(e)}")
         return jsonify([])
 
+def warm_story_voices(session_id):
+    """Start loading the RVC models of every character in a story session"""
+    story_characters = StoryCharacter.query.filter_by(session_id=session_id, is_placeholder=False).all()
+    for sc in story_characters:
+        char_data = character_store.get(sc.character_id) or {}
+        model_cache.warm(char_data.get('rvc_model') or sc.character_id)
+
 @app.route('/story/<session_id>')
 @login_required
 def story_chat_page(session_id):
@@ -2236,7 +2649,9 @@ def story_chat_page(session_id):
         
         if story.creator_id != current_user.id:
             return redirect(url_for('serve_index'))
-            
+
+        warm_story_voices(session_id)
+
         response = make_response(render_template('story-chat.html'))
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         response.headers['Pragma'] = 'no-cache'
@@ -2275,51 +2690,32 @@ def get_story_session(session_id):
                     'background': './assets/default-bg.jpg'  # Use absolute path
                 })
             else:
-                try:
-                    # Load character data from JSON file for complete information
-                    char_file_path = os.path.join(CHARACTER_FOLDER, f"{sc.character_id}.json")
-                    if os.path.exists(char_file_path):
-                        with open(char_file_path, 'r', encoding='utf-8') as f:
-                            char_data = json.load(f)
-                            
-                        # Ensure paths start with ./
-                        avatar_path = char_data.get('avatar', './avatars/default-user.png')
-                        if not avatar_path.startswith('./'):
-                            avatar_path = f"./{avatar_path}"
-                            
-                        background_path = char_data.get('background')
-                        if background_path and not background_path.startswith('./'):
-                            background_path = f"./{background_path}"
-                            
-                        characters.append({
-                            'id': sc.character_id,
-                            'position': sc.position,
-                            'name': char_data.get('name', 'Unknown Character'),
-                            'avatar': avatar_path,
-                            'background': background_path or './assets/default-bg.jpg',
-                            'is_placeholder': False,
-                            'ttsVoice': char_data.get('ttsVoice'),
-                            'rvc_model': char_data.get('rvc_model'),
-                            'tts_rate': char_data.get('tts_rate', 0),
-                            'rvc_pitch': char_data.get('rvc_pitch', 0)
-                        })
-                except Exception as e:
-                    print(f"Error loading character {sc.character_id}: {str(e)}")
-                    # Fallback to database record
-                    char = Character.query.get(sc.character_id)
-                    if char:
-                        characters.append({
-                            'id': char.id,
-                            'position': sc.position,
-                            'name': char.name,
-                            'avatar': './avatars/default-user.png',
-                            'background': './assets/default-bg.jpg',
-                            'is_placeholder': False,
-                            'ttsVoice': char.tts_voice,
-                            'rvc_model': char.settings.get('rvc_model') if char.settings else None,
-                            'tts_rate': char.settings.get('tts_rate', 0) if char.settings else 0,
-                            'rvc_pitch': char.settings.get('rvc_pitch', 0) if char.settings else 0
-                        })
+                char_data = character_store.get(sc.character_id)
+                if char_data is None:
+                    print(f"Character {sc.character_id} not found")
+                    continue
+
+                # Ensure paths start with ./
+                avatar_path = char_data.get('avatar') or './avatars/default-user.png'
+                if not avatar_path.startswith('./'):
+                    avatar_path = f"./{avatar_path}"
+
+                background_path = char_data.get('background')
+                if background_path and not background_path.startswith('./'):
+                    background_path = f"./{background_path}"
+
+                characters.append({
+                    'id': sc.character_id,
+                    'position': sc.position,
+                    'name': char_data.get('name', 'Unknown Character'),
+                    'avatar': avatar_path,
+                    'background': background_path or './assets/default-bg.jpg',
+                    'is_placeholder': False,
+                    'ttsVoice': char_data.get('ttsVoice'),
+                    'rvc_model': char_data.get('rvc_model'),
+                    'tts_rate': char_data.get('tts_rate', 0),
+                    'rvc_pitch': char_data.get('rvc_pitch', 0)
+                })
         
         return jsonify({
             'id': story.id,
@@ -2409,11 +2805,7 @@ Generate only the user's message without any additional explanation or context."
 @require_kobold
 def generate_image():
     try:
-        response = requests.post(
-            f'{KOBOLD_API}/sdapi/v1/txt2img',
-            json=request.json,
-            timeout=60
-        )
+        response = kobold_client.post('/sdapi/v1/txt2img', json=request.json)
         
         if not response.ok:
             return handle_kobold_error(response)
@@ -2436,7 +2828,7 @@ def generate_image():
 @login_required
 def get_multiplayer_story():
     try:
-        response = requests.post(f'{KOBOLD_API}/api/extra/multiplayer/getstory')
+        response = kobold_client.post('/api/extra/multiplayer/getstory')
         if not response.ok:
             return handle_kobold_error(response)
         # Just pass through the raw response text
@@ -2450,10 +2842,7 @@ def get_multiplayer_story():
 @require_kobold
 def set_multiplayer_story():
     try:
-        response = requests.post(
-            f'{KOBOLD_API}/api/extra/multiplayer/setstory',
-            json=request.json
-        )
+        response = kobold_client.post('/api/extra/multiplayer/setstory', json=request.json)
         if not response.ok:
             return handle_kobold_error(response)
         return jsonify(response.json()), response.status_code
@@ -2465,7 +2854,7 @@ def set_multiplayer_story():
 @login_required
 def get_story_state():
     try:
-        response = requests.get(f'{KOBOLD_API}/api/extra/multiplayer/getstory')
+        response = kobold_client.get('/api/extra/multiplayer/getstory')
         if response.ok:
             story_data = response.json()
             if 'data' in story_data:
@@ -2490,10 +2879,7 @@ def update_story():
             "data": compressed_data
         }
 
-        response = requests.post(
-            f'{KOBOLD_API}/api/extra/multiplayer/setstory',
-            json=payload
-        )
+        response = kobold_client.post('/api/extra/multiplayer/setstory', json=payload)
 
         if not response.ok:
             return jsonify({'error': 'Failed to update story'}), response.status_code
@@ -2509,11 +2895,7 @@ def update_story():
 @require_kobold
 def generate_text():
     try:
-        response = requests.post(
-            f'{KOBOLD_API}/api/v1/generate',
-            json=request.json,
-            timeout=30
-        )
+        response = kobold_client.post('/api/v1/generate', json=request.json)
         
         if not response.ok:
             return handle_kobold_error(response)
@@ -2530,12 +2912,38 @@ def generate_text():
 # Initialize database
 with app.app_context():
     db.create_all()
+    character_store.ensure_schema()
+    # First start: fill the empty table from the bundled character files
+    admin = User.query.filter_by(is_admin=True).first()
+    try:
+        imported = character_store.import_if_empty(CHARACTER_FOLDER, default_creator=admin.id if admin else None)
+        if imported:
+            print(f"Imported {len(imported[0])} characters from {CHARACTER_FOLDER}")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error importing characters: {str(e)}")
+# Writes by other worker processes show up within one poll interval
+character_catalog.start_watching(CHARACTER_CATALOG_POLL_INTERVAL)
+# Pre-rendered greetings are kept as long as a character points at them
+audio_retention.is_pinned = audio_cache.is_pinned = character_catalog.uses_audio
+audio_retention.start()
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
         # Initialize queue handlers
-        setup_queue_handlers(kobold_handler, tts_handler)
-        
+        if KOBOLD_BATCH_WINDOW_MS > 0:
+            setup_queue_handlers(kobold_handler, tts_handler,
+                                 kobold_batch_handler=kobold_batch_handler,
+                                 chat_batch_key=chat_batch_key,
+                                 batch_window=KOBOLD_BATCH_WINDOW_MS / 1000,
+                                 max_batch=KOBOLD_BATCH_SIZE,
+                                 kobold_stream_handler=kobold_stream_handler)
+        else:
+            setup_queue_handlers(kobold_handler, tts_handler,
+                                 kobold_stream_handler=kobold_stream_handler)
+
+    model_cache.preload_popular(RVC_PRELOAD_TOP_K)
+
     print("Starting app on internal port 8081 (external 51069)...")
     app.run(host='0.0.0.0', port=8081, debug=False)
\ No newline at end of file